@@ -9,6 +9,7 @@ Exposes:
   POST   /session/create            — Create a new browser session
   POST   /session/{id}/actions      — Execute action batch (navigate, click, fill, screenshot, etc.)
   POST   /session/{id}/screenshot   — Take screenshot of current page
+                                      (raw image/jpeg with `Accept: image/jpeg`)
   DELETE /session/{id}              — Close session
   GET    /health                    — Health check
 """
@@ -16,7 +17,14 @@ import modal
 import uuid
 import asyncio
 import base64
+import binascii
+import re
 import time
+import weakref
+from itertools import groupby
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 
 # ---------------------------------------------------------------------------
 # Modal image: Playwright + Chromium
@@ -37,15 +45,442 @@ app = modal.App("browser-service", image=browser_image)
 # Session management — in-memory browser contexts keyed by session_id
 # ---------------------------------------------------------------------------
 # Sessions are stored per-container. scaledown_window keeps container alive.
-_sessions: dict[str, dict] = {}
-_lock = asyncio.Lock()
+# Ordered least- to most-recently used: touching a session moves it to the end.
+_sessions: OrderedDict[str, dict] = OrderedDict()
 
 SESSION_TIMEOUT_SECS = 300  # 5 min idle timeout
+MAX_SESSIONS = 8  # LRU session is evicted to make room beyond this
+SESSION_MAX_USES = 500  # Action batches / screenshots before a session is retired
+SESSION_MAX_AGE_MS = 60 * 60 * 1000  # Retire sessions after 1 hour regardless of use
+SESSION_MAX_PAGES = 4  # Per-origin pages kept open per session (LRU)
+
+# Idle BrowserContexts, each mapped to its (viewport_width, viewport_height,
+# locale, user_agent). A session leases a context exclusively; when it ends
+# the context is wiped (cookies, storage, permissions) and parked here for the
+# next session with identical settings, skipping full context bring-up.
+# Ordered for LRU eviction.
+_context_pool: OrderedDict[object, tuple] = OrderedDict()
+_pool_lock = asyncio.Lock()
+
+# Origins each context's frames have loaded, so their storage can be wiped
+_context_origins: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+CONTEXT_POOL_MAX = 4
+
+# Background reaper for idle sessions — one per container
+REAPER_INTERVAL_SECS = 30
+_reaper_task: asyncio.Task | None = None
+# Strong references to in-flight eviction closes; the loop only holds tasks weakly
+_eviction_tasks: set[asyncio.Task] = set()
+
+
+class _SessionLocks:
+    """Per-session-id lock registry.
+
+    Calls against different sessions never contend; calls against the same
+    session are serialised FIFO so they don't race on its single Page.
+    """
+
+    def __init__(self):
+        self._d: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @asynccontextmanager
+    async def ctx(self, sid: str):
+        lock = self._d[sid]
+        try:
+            async with lock:
+                yield
+        finally:
+            # Drop the entry once nobody else is queued on it
+            if not lock.locked() and not lock._waiters:
+                if self._d.get(sid) is lock:
+                    del self._d[sid]
+
+
+session_locks = _SessionLocks()
+
+# ---------------------------------------------------------------------------
+# Batched actions — consecutive fills / wait_selectors run in one CDP round-trip
+# ---------------------------------------------------------------------------
+# Returns how many leading (selector, value) pairs were filled. Stops at the
+# first pair whose element is missing or whose selector isn't plain CSS so
+# the remainder can fall back to Playwright's own (auto-waiting) fill.
+FILL_BATCH_JS = """(pairs) => {
+    for (let i = 0; i < pairs.length; i++) {
+        const [s, v] = pairs[i];
+        let el;
+        try { el = document.querySelector(s); } catch (e) { return i; }
+        if (!el || el.disabled || el.readOnly) return i;
+        const desc = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), "value");
+        if (!desc || !desc.set) return i;
+        el.focus();
+        desc.set.call(el, v);  // native setter so framework-controlled inputs see it
+        el.dispatchEvent(new Event("input", {bubbles: true}));
+        el.dispatchEvent(new Event("change", {bubbles: true}));
+    }
+    return pairs.length;
+}"""
+
+# Number of leading selectors that resolve to a visible element, or -1 if a
+# selector isn't plain CSS (e.g. Playwright's text= / xpath= engines).
+COUNT_VISIBLE_JS = """(sels) => {
+    let i = 0;
+    for (; i < sels.length; i++) {
+        let el;
+        try { el = document.querySelector(sels[i]); } catch (e) { return -1; }
+        if (!el || !el.getClientRects().length) break;
+    }
+    return i;
+}"""
+
+WAIT_ALL_VISIBLE_JS = (
+    "(sels) => { const n = (" + COUNT_VISIBLE_JS + ")(sels);"
+    " return (n < 0 || n === sels.length) && {n}; }"
+)
+
+BATCHED_ACTIONS = {"fill", "wait_selector"}
+
+# Helpers installed once per context (runs in every new document) so actions
+# call a fixed function source with arguments instead of shipping freshly
+# formatted JS that V8 has to parse and compile each time.
+PAGE_HELPERS_JS = "window.__nb = { scroll: (d) => window.scrollBy(0, d) };"
+
+# Falls back to a direct call on documents that predate the init script
+# (e.g. the initial about:blank)
+SCROLL_JS = "(d) => window.__nb ? window.__nb.scroll(d) : window.scrollBy(0, d)"
+
+# Serialises an evaluate result to at most EVALUATE_RESULT_MAX chars inside
+# the page, so a huge result never crosses CDP or lands in Python whole.
+EVALUATE_RESULT_MAX = 5000
+CAP_RESULT_JS = """(r) => {
+    let s;
+    if (typeof r === "string") {
+        s = r;
+    } else {
+        try { s = JSON.stringify(r); } catch (e) { s = undefined; }
+        if (s === undefined) s = String(r);
+    }
+    return s.slice(0, %d);
+}""" % EVALUATE_RESULT_MAX
+
+EVALUATE_DENY_RE = re.compile(r"\b(require|process|__proto__|constructor)\b")
+
+# Screenshot defaults — low JPEG quality and a resolution cap keep payloads
+# small; callers can raise either per request.
+SCREENSHOT_QUALITY = 40
+SCREENSHOT_MAX_WIDTH = 1280
+SCREENSHOT_MAX_HEIGHT = 720
+
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/131.0.0.0 Safari/537.36"
+)
+
+
+# ---------------------------------------------------------------------------
+# Per-session page pool — one Page per origin so V8 and connection caches for
+# each site stay hot when a flow alternates between sites. Switching pages
+# pushes the previous one onto the session's back stack, so go_back and
+# go_forward step across pages once a page's own history runs out.
+# ---------------------------------------------------------------------------
+def _make_current(session: dict, page):
+    """Mark page as the session's current, most-recently used page."""
+    pages: list = session["pages"]  # least- to most-recently used
+    if page in pages:
+        pages.remove(page)
+    pages.append(page)
+    session["page"] = page
+
+
+async def page_for_url(session: dict, url: str):
+    """Make the session's page for url's origin current, opening one if needed.
+
+    Relative and about: URLs have no origin and load in the current page.
+    """
+    current = session["page"]
+    origin = urlparse(url).netloc
+    if not origin:
+        return current
+
+    pages: list = session["pages"]
+    page = next(
+        (p for p in pages if not p.is_closed() and urlparse(p.url).netloc == origin),
+        None,
+    )
+    if page is None:
+        # A fresh session's blank page is adopted rather than left idle
+        page = current if current.url == "about:blank" else await current.context.new_page()
+
+    if page is not current:
+        session["back"].append(current)
+        session["forward"].clear()
+    _make_current(session, page)
+
+    while len(pages) > SESSION_MAX_PAGES:
+        try:
+            await pages.pop(0).close()
+        except Exception:
+            pass
+    return page
+
+
+async def restore_page(session: dict, previous):
+    """Undo a page_for_url switch whose navigation failed."""
+    failed = session["page"]
+    if failed is previous:
+        return
+    if session["back"] and session["back"][-1] is previous:
+        session["back"].pop()
+    _make_current(session, previous)
+
+    # A page opened for this navigation that never loaded is just dropped
+    if failed.url == "about:blank":
+        session["pages"].remove(failed)
+        try:
+            await failed.close()
+        except Exception:
+            pass
+
+
+async def step_history(session: dict, forward: bool, timeout_ms: int) -> dict:
+    """go_back / go_forward in the current page, else across to the page switched from."""
+    page = session["page"]
+    url = page.url
+    go = page.go_forward if forward else page.go_back
+    if await go(timeout=timeout_ms) is None and page.url == url:
+        # Nothing left in this page's own history
+        source = session["forward" if forward else "back"]
+        target = session["back" if forward else "forward"]
+        while source:
+            other = source.pop()
+            if not other.is_closed():
+                target.append(page)
+                _make_current(session, other)
+                break
+    return {"url": session["page"].url}
+
+
+def _origin(url: str) -> str | None:
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def track_origins(context):
+    """Record the origin of every frame navigation in context."""
+    origins = _context_origins[context] = set()
+
+    def on_navigated(frame):
+        origin = _origin(frame.url)
+        if origin:
+            origins.add(origin)
+
+    context.on("page", lambda page: page.on("framenavigated", on_navigated))
+
+
+async def _reset_context(context):
+    """Clear everything a session left in context so another can reuse it."""
+    for page in context.pages:
+        await page.close()
+    await context.clear_cookies()
+    await context.clear_permissions()
+
+    origins = _context_origins.get(context, set())
+    origins.update(o["origin"] for o in (await context.storage_state())["origins"])
+    if origins:
+        # localStorage / IndexedDB / cache storage are per origin; CDP wipes them
+        page = await context.new_page()
+        try:
+            cdp = await context.new_cdp_session(page)
+            for origin in origins:
+                await cdp.send(
+                    "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"}
+                )
+        finally:
+            await page.close()
+    origins.clear()
+
+
+async def close_session(session: dict):
+    """Close a session's pages and return its wiped context to the pool.
+
+    A context that can't be wiped is closed rather than handed to another
+    session.
+    """
+    context = session["context"]
+    try:
+        await _reset_context(context)
+    except Exception:
+        try:
+            await context.close()
+        except Exception:
+            pass
+        return
+
+    async with _pool_lock:
+        _context_pool[context] = session["context_key"]
+        while len(_context_pool) > CONTEXT_POOL_MAX:
+            old, _ = _context_pool.popitem(last=False)
+            try:
+                await old.close()
+            except Exception:
+                pass
+
+
+# ---------------------------------------------------------------------------
+# Action handlers — one coroutine per Action.type, dispatched via _DISPATCH
+# ---------------------------------------------------------------------------
+async def capture_jpeg(page, quality: int, max_width: int, max_height: int) -> bytes:
+    """Capture the viewport as JPEG, downscaled to fit max_width x max_height."""
+    viewport = page.viewport_size or {"width": max_width, "height": max_height}
+    scale = min(1.0, max_width / viewport["width"], max_height / viewport["height"])
+    if scale >= 1.0:
+        return await page.screenshot(type="jpeg", quality=quality, scale="css")
+
+    # Playwright can't downscale a capture; CDP's clip.scale can, without
+    # resizing the viewport (which would reflow the page).
+    cdp = await page.context.new_cdp_session(page)
+    try:
+        shot = await cdp.send("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": quality,
+            "clip": {
+                "x": 0,
+                "y": 0,
+                "width": viewport["width"],
+                "height": viewport["height"],
+                "scale": scale,
+            },
+        })
+    finally:
+        await cdp.detach()
+    return base64.b64decode(shot["data"])
+
+
+async def encode_b64(data: bytes) -> str:
+    """Base64-encode off the event loop so concurrent requests aren't stalled."""
+    loop = asyncio.get_running_loop()
+    encoded = await loop.run_in_executor(
+        None, lambda: binascii.b2a_base64(data, newline=False)
+    )
+    return encoded.decode("ascii")
+
+
+async def _do_navigate(page, action) -> dict:
+    if not action.url:
+        raise ValueError("navigate requires 'url'")
+    await page.goto(action.url, timeout=action.timeout_ms, wait_until="domcontentloaded")
+    return {"url": page.url}
+
+
+async def _do_click(page, action) -> dict:
+    if not action.selector:
+        raise ValueError("click requires 'selector'")
+    await page.click(action.selector, timeout=action.timeout_ms)
+    return {}
+
+
+async def _do_fill(page, action) -> dict:
+    if not action.selector or action.value is None:
+        raise ValueError("fill requires 'selector' and 'value'")
+    await page.fill(action.selector, action.value, timeout=action.timeout_ms)
+    return {}
+
+
+async def _do_fill_credentials(page, action) -> dict:
+    # Credentials are pre-decrypted by Lambda and passed as plaintext
+    if not action.username_selector or not action.password_selector:
+        raise ValueError(
+            "fill_credentials requires username_selector and password_selector"
+        )
+    if action.encrypted_username:
+        await page.fill(
+            action.username_selector, action.encrypted_username, timeout=action.timeout_ms
+        )
+    if action.encrypted_password:
+        await page.fill(
+            action.password_selector, action.encrypted_password, timeout=action.timeout_ms
+        )
+    return {}
+
+
+async def _do_select(page, action) -> dict:
+    if not action.selector or action.value is None:
+        raise ValueError("select requires 'selector' and 'value'")
+    await page.select_option(action.selector, action.value, timeout=action.timeout_ms)
+    return {}
+
+
+async def _do_screenshot(page, action) -> dict:
+    screenshot_bytes = await capture_jpeg(
+        page, action.quality, action.max_width, action.max_height
+    )
+    screenshot_b64 = await encode_b64(screenshot_bytes)
+    return {"screenshot": screenshot_b64}
+
+
+async def _do_wait_navigation(page, action) -> dict:
+    await page.wait_for_load_state("domcontentloaded", timeout=action.timeout_ms)
+    return {"url": page.url}
+
+
+async def _do_wait_selector(page, action) -> dict:
+    if not action.selector:
+        raise ValueError("wait_selector requires 'selector'")
+    await page.wait_for_selector(action.selector, timeout=action.timeout_ms)
+    return {}
+
+
+async def _do_scroll(page, action) -> dict:
+    direction = action.direction or "down"
+    amount = action.amount or 500
+    delta = amount if direction == "down" else -amount
+    await page.evaluate(SCROLL_JS, delta)
+    return {}
+
+
+async def _do_evaluate(page, action) -> dict:
+    if not action.expression:
+        raise ValueError("evaluate requires 'expression'")
+    # Safety: limit expression length
+    if len(action.expression) > 2000:
+        raise ValueError("Expression too long (max 2000 chars)")
+    match = EVALUATE_DENY_RE.search(action.expression)
+    if match:
+        raise ValueError(f"Expression uses disallowed identifier '{match.group(1)}'")
+
+    # Keep the raw result in the page and only pull back the capped string
+    handle = await page.evaluate_handle(action.expression)
+    try:
+        result = await handle.evaluate(CAP_RESULT_JS)
+    finally:
+        await handle.dispose()
+    return {"result": result}
+
+
+_DISPATCH = {
+    "navigate": _do_navigate,
+    "click": _do_click,
+    "fill": _do_fill,
+    "fill_credentials": _do_fill_credentials,
+    "select": _do_select,
+    "screenshot": _do_screenshot,
+    "wait_navigation": _do_wait_navigation,
+    "wait_selector": _do_wait_selector,
+    "scroll": _do_scroll,
+    "evaluate": _do_evaluate,
+}
+
+# Handled by step_history, since they can move the session to another page
+HISTORY_ACTIONS = {"go_back": False, "go_forward": True}
+
 
 # ---------------------------------------------------------------------------
 # Web endpoint
 # ---------------------------------------------------------------------------
-@app.function(
+@app.cls(
     cpu=2.0,
     memory=2048,
     timeout=600,
@@ -53,280 +488,369 @@ SESSION_TIMEOUT_SECS = 300  # 5 min idle timeout
     scaledown_window=600,  # Keep container alive 10 min after last request
 )
 @modal.concurrent(max_inputs=4)
-@modal.asgi_app()
-def web():
-    from fastapi import FastAPI, HTTPException
-    from fastapi.responses import JSONResponse
-    from pydantic import BaseModel, Field
-    from playwright.async_api import async_playwright
-
-    fastapi_app = FastAPI(title="Browser Automation Service", version="1.0")
-
-    # Lazy-initialized Playwright instance (shared across requests in same container)
-    _playwright = None
-    _browser = None
-
-    async def get_browser():
-        nonlocal _playwright, _browser
-        if _browser is None or not _browser.is_connected():
-            _playwright = await async_playwright().start()
-            _browser = await _playwright.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-gpu",
-                    "--disable-extensions",
-                    "--lang=ja-JP,ja,en-US,en",
-                ],
-            )
-        return _browser
+class BrowserService:
+    @modal.enter()
+    async def start_browser(self):
+        """Launch Chromium at container boot so no request pays the cold start."""
+        from playwright.async_api import async_playwright
 
-    # ---- Request models ----
+        self._playwright = await async_playwright().start()
+        self._browser = await self._launch_browser()
 
-    class CreateSessionRequest(BaseModel):
-        user_agent: str | None = Field(
-            default=None,
-            description="Custom User-Agent string",
-        )
-        viewport_width: int = Field(default=1280, ge=320, le=1920)
-        viewport_height: int = Field(default=720, ge=240, le=1080)
-        locale: str = Field(default="ja-JP")
-
-    class Action(BaseModel):
-        type: str = Field(
-            description="Action type: navigate, click, fill, fill_credentials, "
-            "select, screenshot, wait_navigation, wait_selector, scroll, "
-            "evaluate, go_back, go_forward"
+    @modal.exit()
+    async def stop_browser(self):
+        try:
+            await self._browser.close()
+        finally:
+            await self._playwright.stop()
+
+    async def _launch_browser(self):
+        return await self._playwright.chromium.launch(
+            headless=True,
+            args=[
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                "--disable-gpu",
+                "--disable-extensions",
+                "--lang=ja-JP,ja,en-US,en",
+            ],
         )
-        url: str | None = None
-        selector: str | None = None
-        value: str | None = None
-        timeout_ms: int = Field(default=10000, ge=1000, le=30000)
-        # For fill_credentials
-        service_name: str | None = None
-        username_selector: str | None = None
-        password_selector: str | None = None
-        encrypted_username: str | None = None
-        encrypted_password: str | None = None
-        # For evaluate
-        expression: str | None = None
-        # For scroll
-        direction: str | None = Field(default="down", description="up or down")
-        amount: int | None = Field(default=500, description="Pixels to scroll")
-
-    class ActionsRequest(BaseModel):
-        actions: list[Action] = Field(min_length=1, max_length=20)
-
-    # ---- Helpers ----
-
-    async def cleanup_expired():
-        """Remove sessions idle for more than SESSION_TIMEOUT_SECS."""
-        now = time.time()
-        expired = [
-            sid for sid, s in _sessions.items()
-            if now - s["last_active"] > SESSION_TIMEOUT_SECS
-        ]
-        for sid in expired:
-            session = _sessions.pop(sid, None)
-            if session and session.get("context"):
+
+    # Label keeps the endpoint URL the same as when this was a plain function
+    @modal.asgi_app(label="browser-service-web")
+    def web(self):
+        from urllib.parse import quote
+        from fastapi import FastAPI, HTTPException, Request
+        from fastapi.responses import JSONResponse, Response
+        from pydantic import BaseModel, Field
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+        fastapi_app = FastAPI(title="Browser Automation Service", version="1.0")
+
+        async def get_browser():
+            global _reaper_task
+            if _reaper_task is None:
+                _reaper_task = asyncio.create_task(_reaper_loop())
+            if self._browser is None or not self._browser.is_connected():
+                # Contexts from a dead browser are unusable
+                _context_pool.clear()
+                self._browser = await self._launch_browser()
+            return self._browser
+
+        async def get_context(key: tuple):
+            """Lease an idle pooled BrowserContext for key, creating one on a miss."""
+            async with _pool_lock:
+                browser = await get_browser()
+                for context, idle_key in _context_pool.items():
+                    if idle_key == key:
+                        del _context_pool[context]
+                        return context
+
+                width, height, locale, user_agent = key
+                context = await browser.new_context(
+                    viewport={"width": width, "height": height},
+                    locale=locale,
+                    user_agent=user_agent,
+                )
+                await context.add_init_script(PAGE_HELPERS_JS)
+                track_origins(context)
+                return context
+
+        # ---- Request models ----
+
+        class CreateSessionRequest(BaseModel):
+            user_agent: str | None = Field(
+                default=None,
+                description="Custom User-Agent string",
+            )
+            viewport_width: int = Field(default=1280, ge=320, le=1920)
+            viewport_height: int = Field(default=720, ge=240, le=1080)
+            locale: str = Field(default="ja-JP")
+
+        class Action(BaseModel):
+            type: str = Field(
+                description="Action type: navigate, click, fill, fill_credentials, "
+                "select, screenshot, wait_navigation, wait_selector, scroll, "
+                "evaluate, go_back, go_forward"
+            )
+            url: str | None = None
+            selector: str | None = None
+            value: str | None = None
+            timeout_ms: int = Field(default=10000, ge=1000, le=30000)
+            # For fill_credentials
+            service_name: str | None = None
+            username_selector: str | None = None
+            password_selector: str | None = None
+            encrypted_username: str | None = None
+            encrypted_password: str | None = None
+            # For evaluate
+            expression: str | None = None
+            # For scroll
+            direction: str | None = Field(default="down", description="up or down")
+            amount: int | None = Field(default=500, description="Pixels to scroll")
+            # For screenshot
+            quality: int = Field(default=SCREENSHOT_QUALITY, ge=10, le=100)
+            max_width: int = Field(default=SCREENSHOT_MAX_WIDTH, ge=160, le=1920)
+            max_height: int = Field(default=SCREENSHOT_MAX_HEIGHT, ge=120, le=1080)
+
+        class ActionsRequest(BaseModel):
+            actions: list[Action] = Field(min_length=1, max_length=20)
+
+        class ScreenshotRequest(BaseModel):
+            quality: int = Field(default=SCREENSHOT_QUALITY, ge=10, le=100)
+            max_width: int = Field(default=SCREENSHOT_MAX_WIDTH, ge=160, le=1920)
+            max_height: int = Field(default=SCREENSHOT_MAX_HEIGHT, ge=120, le=1080)
+
+        # ---- Helpers ----
+
+        async def cleanup_expired():
+            """Remove sessions idle for more than SESSION_TIMEOUT_SECS."""
+            now = time.time()
+            # LRU order means the idle sessions are a prefix
+            expired = []
+            for sid, s in _sessions.items():
+                if now - s["last_active"] <= SESSION_TIMEOUT_SECS:
+                    break
+                expired.append(sid)
+            for sid in expired:
+                # Wait out any in-flight action instead of closing its page under it
+                async with session_locks.ctx(sid):
+                    session = _sessions.get(sid)
+                    if not session or time.time() - session["last_active"] <= SESSION_TIMEOUT_SECS:
+                        continue
+                    del _sessions[sid]
+                    await close_session(session)
+
+        async def close_evicted(session_id: str, session: dict):
+            """Close an evicted session once any in-flight call finishes."""
+            async with session_locks.ctx(session_id):
+                await close_session(session)
+
+        async def touch_session(session_id: str) -> dict:
+            """Look up a session and mark it most-recently used.
+
+            Call with the session's lock held. Sessions past SESSION_MAX_USES or
+            SESSION_MAX_AGE_MS are retired here and answered with 410.
+            """
+            session = _sessions.get(session_id)
+            if not session:
+                raise HTTPException(404, f"Session {session_id} not found")
+
+            now = time.time()
+            session["uses"] += 1
+            if (
+                session["uses"] > SESSION_MAX_USES
+                or (now - session["created_at"]) * 1000 > SESSION_MAX_AGE_MS
+            ):
+                del _sessions[session_id]
+                await close_session(session)
+                raise HTTPException(410, f"Session {session_id} expired; create a new one")
+
+            session["last_active"] = now
+            _sessions.move_to_end(session_id)
+            return session
+
+        async def _reaper_loop():
+            """Reap idle sessions off the request path."""
+            while True:
+                await asyncio.sleep(REAPER_INTERVAL_SECS)
                 try:
-                    await session["context"].close()
-                except Exception:
-                    pass
-
-    # ---- Endpoints ----
-
-    @fastapi_app.get("/health")
-    async def health():
-        await cleanup_expired()
-        return {
-            "status": "ok",
-            "active_sessions": len(_sessions),
-            "timeout_secs": SESSION_TIMEOUT_SECS,
-        }
-
-    @fastapi_app.post("/session/create")
-    async def create_session(req: CreateSessionRequest):
-        await cleanup_expired()
-
-        if len(_sessions) >= 8:
-            raise HTTPException(429, "Too many active sessions")
-
-        browser = await get_browser()
-        context = await browser.new_context(
-            viewport={"width": req.viewport_width, "height": req.viewport_height},
-            locale=req.locale,
-            user_agent=req.user_agent or (
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/131.0.0.0 Safari/537.36"
-            ),
-        )
-        page = await context.new_page()
-        session_id = str(uuid.uuid4())
+                    await cleanup_expired()
+                except Exception as e:
+                    print(f"Session reaper error: {e}")
+
+        # ---- Endpoints ----
+
+        @fastapi_app.get("/health")
+        async def health():
+            return {
+                "status": "ok",
+                "active_sessions": len(_sessions),
+                "timeout_secs": SESSION_TIMEOUT_SECS,
+            }
+
+        @fastapi_app.post("/session/create")
+        async def create_session(req: CreateSessionRequest):
+            context_key = (
+                req.viewport_width,
+                req.viewport_height,
+                req.locale,
+                req.user_agent or DEFAULT_USER_AGENT,
+            )
+            context = await get_context(context_key)
+            page = await context.new_page()
+            session_id = str(uuid.uuid4())
+
+            # Evict least-recently-used sessions instead of rejecting new ones
+            while len(_sessions) >= MAX_SESSIONS:
+                old_sid, old = _sessions.popitem(last=False)
+                task = asyncio.create_task(close_evicted(old_sid, old))
+                _eviction_tasks.add(task)
+                task.add_done_callback(_eviction_tasks.discard)
 
-        async with _lock:
             _sessions[session_id] = {
                 "context": context,
-                "page": page,
+                "context_key": context_key,
+                "page": page,  # current page; actions target this
+                "pages": [page],
+                "back": [],  # pages switched away from, for go_back
+                "forward": [],
                 "created_at": time.time(),
                 "last_active": time.time(),
+                "uses": 0,
             }
 
-        return {"session_id": session_id}
+            return {"session_id": session_id}
+
+        @fastapi_app.post("/session/{session_id}/actions")
+        async def execute_actions(session_id: str, req: ActionsRequest):
+            async with session_locks.ctx(session_id):
+                session = await touch_session(session_id)
+                results = []
+
+                # Consecutive same-type actions form a run; batchable runs go
+                # to the page in a single evaluate, the rest one at a time.
+                for _, run in groupby(req.actions, key=lambda a: a.type):
+                    if not await _execute_run(session, list(run), results):
+                        # Stop batch on error
+                        break
+
+                page = session["page"]
+                return {
+                    "session_id": session_id,
+                    "results": results,
+                    "page_url": page.url,
+                    "page_title": await page.title(),
+                }
+
+        @fastapi_app.post("/session/{session_id}/screenshot")
+        async def take_screenshot(
+            session_id: str, request: Request, req: ScreenshotRequest | None = None
+        ):
+            req = req or ScreenshotRequest()
+            async with session_locks.ctx(session_id):
+                session = await touch_session(session_id)
+                page = session["page"]
+
+                screenshot_bytes = await capture_jpeg(
+                    page, req.quality, req.max_width, req.max_height
+                )
+
+                # Binary response skips the base64 inflation for clients that ask
+                if "image/jpeg" in request.headers.get("accept", ""):
+                    return Response(
+                        content=screenshot_bytes,
+                        media_type="image/jpeg",
+                        headers={
+                            "X-Page-Url": quote(page.url, safe=":/?&=%#"),
+                            "X-Page-Title": quote(await page.title()),
+                        },
+                    )
 
-    @fastapi_app.post("/session/{session_id}/actions")
-    async def execute_actions(session_id: str, req: ActionsRequest):
-        session = _sessions.get(session_id)
-        if not session:
-            raise HTTPException(404, f"Session {session_id} not found")
+                screenshot_b64 = await encode_b64(screenshot_bytes)
 
-        session["last_active"] = time.time()
-        page = session["page"]
-        results = []
+                return {
+                    "session_id": session_id,
+                    "screenshot": screenshot_b64,
+                    "page_url": page.url,
+                    "page_title": await page.title(),
+                }
 
-        for action in req.actions:
-            try:
-                result = await _execute_single_action(page, action)
-                results.append({"status": "ok", "type": action.type, **result})
-            except Exception as e:
-                results.append({
-                    "status": "error",
-                    "type": action.type,
-                    "error": str(e),
-                })
-                # Stop batch on error
-                break
+        @fastapi_app.delete("/session/{session_id}")
+        async def delete_session(session_id: str):
+            async with session_locks.ctx(session_id):
+                session = _sessions.pop(session_id, None)
+                if not session:
+                    raise HTTPException(404, f"Session {session_id} not found")
 
-        return {
-            "session_id": session_id,
-            "results": results,
-            "page_url": page.url,
-            "page_title": await page.title(),
-        }
-
-    @fastapi_app.post("/session/{session_id}/screenshot")
-    async def take_screenshot(session_id: str):
-        session = _sessions.get(session_id)
-        if not session:
-            raise HTTPException(404, f"Session {session_id} not found")
-
-        session["last_active"] = time.time()
-        page = session["page"]
-
-        screenshot_bytes = await page.screenshot(type="jpeg", quality=75)
-        screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
-
-        return {
-            "session_id": session_id,
-            "screenshot": screenshot_b64,
-            "page_url": page.url,
-            "page_title": await page.title(),
-        }
-
-    @fastapi_app.delete("/session/{session_id}")
-    async def delete_session(session_id: str):
-        session = _sessions.pop(session_id, None)
-        if not session:
-            raise HTTPException(404, f"Session {session_id} not found")
+                await close_session(session)
 
-        try:
-            await session["context"].close()
-        except Exception:
-            pass
+                return {"status": "deleted", "session_id": session_id}
 
-        return {"status": "deleted", "session_id": session_id}
-
-    # ---- Single action executor ----
-
-    async def _execute_single_action(page, action: Action) -> dict:
-        timeout = action.timeout_ms
-
-        match action.type:
-            case "navigate":
-                if not action.url:
-                    raise ValueError("navigate requires 'url'")
-                await page.goto(action.url, timeout=timeout, wait_until="domcontentloaded")
-                return {"url": page.url}
-
-            case "click":
-                if not action.selector:
-                    raise ValueError("click requires 'selector'")
-                await page.click(action.selector, timeout=timeout)
-                return {}
-
-            case "fill":
-                if not action.selector or action.value is None:
-                    raise ValueError("fill requires 'selector' and 'value'")
-                await page.fill(action.selector, action.value, timeout=timeout)
-                return {}
-
-            case "fill_credentials":
-                # Credentials are pre-decrypted by Lambda and passed as plaintext
-                if not action.username_selector or not action.password_selector:
-                    raise ValueError(
-                        "fill_credentials requires username_selector and password_selector"
-                    )
-                if action.encrypted_username:
-                    await page.fill(
-                        action.username_selector, action.encrypted_username, timeout=timeout
-                    )
-                if action.encrypted_password:
-                    await page.fill(
-                        action.password_selector, action.encrypted_password, timeout=timeout
+        # ---- Run / batch executors ----
+
+        async def _execute_run(session: dict, run: list[Action], results: list) -> bool:
+            """Execute a run of same-type actions, appending to results.
+
+            Returns False if an action failed and the batch should stop.
+            """
+            done, error = 0, None
+            if len(run) > 1 and run[0].type in BATCHED_ACTIONS:
+                done, error = await _execute_batch(session["page"], run)
+
+            results.extend({"status": "ok", "type": a.type} for a in run[:done])
+            if error:
+                results.append({"status": "error", "type": run[done].type, "error": error})
+                return False
+
+            for action in run[done:]:
+                previous = session["page"]
+                try:
+                    if action.type in HISTORY_ACTIONS:
+                        result = await step_history(
+                            session, HISTORY_ACTIONS[action.type], action.timeout_ms
+                        )
+                    else:
+                        if action.type == "navigate" and action.url:
+                            await page_for_url(session, action.url)
+                        result = await _execute_single_action(session["page"], action)
+                    results.append({"status": "ok", "type": action.type, **result})
+                except Exception as e:
+                    if action.type == "navigate":
+                        # Don't leave the session on a page that never loaded
+                        await restore_page(session, previous)
+                    results.append({
+                        "status": "error",
+                        "type": action.type,
+                        "error": str(e),
+                    })
+                    return False
+            return True
+
+        async def _execute_batch(page, run: list[Action]) -> tuple[int, str | None]:
+            """Execute a homogeneous run in one page round-trip.
+
+            Returns (completed, error): the number of leading actions done and an
+            error for the next one, if any. Actions past the completed prefix with
+            no error fall back to the per-action path.
+            """
+            if any(not a.selector for a in run):
+                return 0, None
+
+            try:
+                if run[0].type == "fill":
+                    if any(a.value is None for a in run):
+                        return 0, None
+                    pairs = [[a.selector, a.value] for a in run]
+                    return await page.evaluate(FILL_BATCH_JS, pairs), None
+
+                # wait_selector
+                selectors = [a.selector for a in run]
+                timeout = max(a.timeout_ms for a in run)
+                try:
+                    handle = await page.wait_for_function(
+                        WAIT_ALL_VISIBLE_JS, arg=selectors, timeout=timeout
                     )
-                return {}
-
-            case "select":
-                if not action.selector or action.value is None:
-                    raise ValueError("select requires 'selector' and 'value'")
-                await page.select_option(action.selector, action.value, timeout=timeout)
-                return {}
-
-            case "screenshot":
-                screenshot_bytes = await page.screenshot(type="jpeg", quality=75)
-                screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
-                return {"screenshot": screenshot_b64}
-
-            case "wait_navigation":
-                await page.wait_for_load_state("domcontentloaded", timeout=timeout)
-                return {"url": page.url}
-
-            case "wait_selector":
-                if not action.selector:
-                    raise ValueError("wait_selector requires 'selector'")
-                await page.wait_for_selector(action.selector, timeout=timeout)
-                return {}
-
-            case "scroll":
-                direction = action.direction or "down"
-                amount = action.amount or 500
-                delta = amount if direction == "down" else -amount
-                await page.evaluate(f"window.scrollBy(0, {delta})")
-                return {}
-
-            case "evaluate":
-                if not action.expression:
-                    raise ValueError("evaluate requires 'expression'")
-                # Safety: limit expression length
-                if len(action.expression) > 2000:
-                    raise ValueError("Expression too long (max 2000 chars)")
-                result = await page.evaluate(action.expression)
-                return {"result": str(result)[:5000]}
-
-            case "go_back":
-                await page.go_back(timeout=timeout)
-                return {"url": page.url}
-
-            case "go_forward":
-                await page.go_forward(timeout=timeout)
-                return {"url": page.url}
-
-            case _:
+                    n = (await handle.json_value())["n"]
+                    return (0, None) if n < 0 else (n, None)
+                except PlaywrightTimeoutError:
+                    n = await page.evaluate(COUNT_VISIBLE_JS, selectors)
+                    if n < 0:
+                        return 0, None
+                    return n, f"Timeout {timeout}ms exceeded waiting for selector {selectors[n]!r}"
+            except Exception:
+                # e.g. navigation destroyed the execution context; replay per action
+                return 0, None
+
+        # ---- Single action executor ----
+
+        async def _execute_single_action(page, action: Action) -> dict:
+            handler = _DISPATCH.get(action.type)
+            if not handler:
                 raise ValueError(f"Unknown action type: {action.type}")
+            return await handler(page, action)
 
-    return fastapi_app
+        return fastapi_app
 
 
 # ---------------------------------------------------------------------------
@@ -6,15 +6,24 @@ Test:    modal run cosyvoice_tts.py
 Logs:    modal app logs cosyvoice-tts
 
 Exposes:
-  POST /synthesize  — JSON body: { text, mode?, prompt_audio?, prompt_text?, speaker_id?, speed? }
-                      Returns: audio/mpeg or audio/wav bytes
+  POST /synthesize  — JSON body: { text, mode?, prompt_audio?, prompt_text?, speaker_id?, speed?,
+                                   high_quality_tempo? }
+                      Returns: audio/mpeg (streamed chunk-by-chunk) or audio/wav bytes
   GET  /health      — Returns model status
   GET  /speakers    — Lists available speakers
 """
 import io
+import os
+import math
+import uuid
 import base64
+import inspect
+from contextlib import contextmanager
 import modal
 
+MODEL_DIR = "/root/.cache/modelscope/iic/CosyVoice2-0___5B"
+INDUCTOR_CACHE_DIR = "/root/.cache/torchinductor"
+
 # ---------------------------------------------------------------------------
 # Modal image: CosyVoice 2 with all dependencies
 # ---------------------------------------------------------------------------
@@ -28,8 +37,10 @@ cosyvoice_image = (
         "soundfile",
         "numpy",
         "pydub",
+        "av",
         "fastapi[standard]",
         "onnxruntime",
+        "tensorrt-cu12",  # flow-decoder engine for load_trt=True
         "modelscope",
         "huggingface_hub",
     )
@@ -46,10 +57,35 @@ cosyvoice_image = (
         "print('CosyVoice2 model cached')"
         '"'
     )
+    # Build the fp16 TensorRT engine on the serving GPU type during image build;
+    # CosyVoice caches the .plan next to the weights, so containers skip it
+    .run_commands(
+        'python3 -c "'
+        "import sys; "
+        "sys.path += ['/tmp/CosyVoice', '/tmp/CosyVoice/third_party/Matcha-TTS']; "
+        "from cosyvoice.cli.cosyvoice import CosyVoice2; "
+        f"CosyVoice2('{MODEL_DIR}', load_jit=True, load_trt=True, fp16=True); "
+        "print('CosyVoice2 TensorRT engine built')"
+        '"',
+        gpu="A10G",
+    )
+    .env({"TORCHINDUCTOR_CACHE_DIR": INDUCTOR_CACHE_DIR})
 )
 
 app = modal.App("cosyvoice-tts", image=cosyvoice_image)
 
+# Inductor artifacts persist across containers so torch.compile is paid once
+inductor_cache = modal.Volume.from_name("cosyvoice-inductor-cache", create_if_missing=True)
+
+
+def check_mode_args(mode: str, prompt_audio: str | None, instruct_text: str) -> None:
+    """Raise ValueError if the inputs required by mode are missing."""
+    if mode in ("zero_shot", "cross_lingual") and not prompt_audio:
+        raise ValueError(f"prompt_audio required for {mode} mode")
+    if mode == "instruct" and (not prompt_audio or not instruct_text):
+        raise ValueError("prompt_audio and instruct_text required")
+
+
 # ---------------------------------------------------------------------------
 # Model container — GPU instance with CosyVoice loaded
 # ---------------------------------------------------------------------------
@@ -57,6 +93,7 @@ app = modal.App("cosyvoice-tts", image=cosyvoice_image)
     gpu="A10G",  # 24GB VRAM
     scaledown_window=300,  # Keep warm for 5 min
     timeout=600,
+    volumes={INDUCTOR_CACHE_DIR: inductor_cache},
 )
 class CosyVoiceTTS:
     @modal.enter()
@@ -69,11 +106,47 @@ class CosyVoiceTTS:
         from cosyvoice.cli.cosyvoice import CosyVoice2
 
         print("Loading CosyVoice2 model...")
-        model_dir = "/root/.cache/modelscope/iic/CosyVoice2-0___5B"
-        self.cosyvoice = CosyVoice2(model_dir, load_jit=False, load_trt=False)
+        # fp16 weights + TorchScript text encoder + TensorRT flow decoder
+        # (engine pre-built into the image) use the A10G tensor cores
+        self.cosyvoice = CosyVoice2(MODEL_DIR, load_jit=True, load_trt=True, fp16=True)
         self.sample_rate = self.cosyvoice.sample_rate
         print(f"CosyVoice2 loaded. Sample rate: {self.sample_rate}")
 
+        # Resample kernels keyed by (source rate, dtype, device) — prompt audio
+        # is nearly always 44.1k or 48k, so building the filter once pays off
+        self._resamplers: dict[tuple, object] = {}
+        # STFT window + phase advance for the tempo phase vocoder, per device
+        self._stretch_kernels: dict = {}
+
+        # Older CosyVoice builds take the prompt as a 16k tensor; newer ones
+        # take a wav path and load it themselves
+        params = inspect.signature(self.cosyvoice.inference_zero_shot).parameters
+        self._prompt_as_tensor = "prompt_speech_16k" in params
+
+        self._compile_llm()
+
+    def _compile_llm(self):
+        """torch.compile the LLM's transformer and pay the compile cost now.
+
+        Compiles the inner HF model that runs once per generated token, since
+        the wrapper's inference() isn't routed through forward(). The flow
+        decoder is already a TensorRT engine. Falls back to eager if the
+        compile or warmup fails.
+        """
+        import torch
+
+        llm = self.cosyvoice.model.llm.llm
+        eager = llm.model
+        try:
+            llm.model = torch.compile(eager, dynamic=True)
+            for _ in self._inference("ウォームアップ。", "sft", "", None, "", "", stream=False):
+                pass
+            inductor_cache.commit()
+            print("CosyVoice2 LLM compiled")
+        except Exception as e:
+            print(f"torch.compile failed, using eager LLM: {e}")
+            llm.model = eager
+
     def _load_audio(self, audio_data: str | None) -> tuple | None:
         """Load audio from base64 string."""
         if not audio_data:
@@ -89,11 +162,142 @@ class CosyVoiceTTS:
 
         # Resample to 16kHz if needed
         if sr != 16000:
-            resampler = torchaudio.transforms.Resample(sr, 16000)
+            key = (sr, waveform.dtype, waveform.device)
+            resampler = self._resamplers.get(key)
+            if resampler is None:
+                resampler = torchaudio.transforms.Resample(sr, 16000, dtype=waveform.dtype)
+                resampler = self._resamplers.setdefault(key, resampler.to(waveform.device))
             waveform = resampler(waveform)
 
         return waveform, 16000
 
+    @contextmanager
+    def _prompt_source(self, prompt_audio: str):
+        """Yield the prompt in the form this CosyVoice build accepts.
+
+        Hands the 16k tensor straight through when the API takes one. Otherwise
+        writes a per-request temp file (concurrent inputs share the container)
+        and removes it once inference is done.
+        """
+        import torchaudio
+
+        waveform, sr = self._load_audio(prompt_audio)
+        if self._prompt_as_tensor:
+            yield waveform.mean(dim=0, keepdim=True)
+            return
+
+        tmp_path = f"/tmp/prompt-{uuid.uuid4().hex}.wav"
+        torchaudio.save(tmp_path, waveform, sr)
+        try:
+            yield tmp_path
+        finally:
+            os.unlink(tmp_path)
+
+    def _inference(
+        self,
+        text: str,
+        mode: str,
+        speaker_id: str,
+        prompt_audio: str | None,
+        prompt_text: str,
+        instruct_text: str,
+        stream: bool,
+    ):
+        """Run inference for mode, yielding tts_speech chunks as [1, T] tensors."""
+        check_mode_args(mode, prompt_audio, instruct_text)
+
+        if mode not in ("zero_shot", "cross_lingual", "instruct"):  # SFT mode
+            spk = speaker_id or self.cosyvoice.list_available_spks()[0]
+            for r in self.cosyvoice.inference_sft(text, spk, stream=stream):
+                yield r["tts_speech"]
+            return
+
+        # Prompt stays alive until the (lazy) inference generator is drained
+        with self._prompt_source(prompt_audio) as prompt:
+            if mode == "zero_shot":
+                results = self.cosyvoice.inference_zero_shot(
+                    text, prompt_text, prompt, stream=stream
+                )
+            elif mode == "cross_lingual":
+                results = self.cosyvoice.inference_cross_lingual(
+                    text, prompt, stream=stream
+                )
+            else:  # instruct
+                results = self.cosyvoice.inference_instruct2(
+                    text, instruct_text, prompt, stream=stream
+                )
+
+            for r in results:
+                yield r["tts_speech"]
+
+    def _apply_speed(self, audio, speed: float, high_quality_tempo: bool = False):
+        """Change tempo of a [1, T] waveform without changing pitch.
+
+        Uses an STFT phase vocoder that runs on whatever device audio is on.
+        high_quality_tempo routes through libsox's WSOLA tempo instead, which
+        sounds cleaner but runs on CPU.
+        """
+        import torch
+        import torchaudio
+
+        if speed == 1.0 or speed <= 0:
+            return audio
+
+        if high_quality_tempo:
+            effects = [["tempo", str(speed)]]
+            audio, _ = torchaudio.sox_effects.apply_effects_tensor(
+                audio.cpu(), self.sample_rate, effects
+            )
+            return audio
+
+        n_fft, hop = 1024, 256
+        kernels = self._stretch_kernels.get(audio.device)
+        if kernels is None:
+            window = torch.hann_window(n_fft, device=audio.device)
+            phase_advance = torch.linspace(
+                0, math.pi * hop, n_fft // 2 + 1, device=audio.device
+            )[..., None]
+            kernels = self._stretch_kernels.setdefault(audio.device, (window, phase_advance))
+        window, phase_advance = kernels
+
+        spec = torch.stft(
+            audio, n_fft, hop_length=hop, window=window, return_complex=True
+        )
+        spec = torchaudio.functional.phase_vocoder(spec, speed, phase_advance)
+        return torch.istft(
+            spec, n_fft, hop_length=hop, window=window,
+            length=int(audio.shape[-1] / speed),
+        )
+
+    def _mp3_frames(self, chunks):
+        """Encode an iterable of [1, T] waveforms to MP3, yielding frames as ready.
+
+        One in-process libmp3lame context per call (an encoder can't be
+        restarted once flushed), with no muxer or subprocess around it.
+        """
+        import av
+        import numpy as np
+
+        encoder = av.CodecContext.create("libmp3lame", "w")
+        encoder.sample_rate = self.sample_rate
+        encoder.layout = "mono"
+        encoder.format = "fltp"
+        encoder.bit_rate = 128000
+
+        pts = 0
+        for chunk in chunks:
+            samples = chunk.cpu().numpy().astype(np.float32).reshape(1, -1)
+            frame = av.AudioFrame.from_ndarray(samples, format="fltp", layout="mono")
+            frame.sample_rate = self.sample_rate
+            frame.pts = pts
+            pts += samples.shape[1]
+            for packet in encoder.encode(frame):
+                yield bytes(packet)
+
+        # Flush frames buffered inside the encoder
+        for packet in encoder.encode(None):
+            yield bytes(packet)
+
     @modal.method()
     def synthesize(
         self,
@@ -105,6 +309,7 @@ class CosyVoiceTTS:
         instruct_text: str = "",
         speed: float = 1.0,
         output_format: str = "mp3",
+        high_quality_tempo: bool = False,
     ) -> bytes:
         """
         Synthesize speech from text.
@@ -119,6 +324,8 @@ class CosyVoiceTTS:
             instruct_text: Style instruction (for instruct mode)
             speed: Speech speed multiplier
             output_format: "mp3" or "wav"
+            high_quality_tempo: Use sox (CPU) instead of the phase vocoder
+                                for speed changes
 
         Returns:
             Audio bytes
@@ -127,78 +334,63 @@ class CosyVoiceTTS:
         import torchaudio
 
         try:
-            # Run inference based on mode
-            if mode == "zero_shot":
-                if not prompt_audio:
-                    raise ValueError("prompt_audio required for zero_shot mode")
-
-                waveform, sr = self._load_audio(prompt_audio)
-
-                # Save to temp file
-                tmp_path = "/tmp/prompt.wav"
-                torchaudio.save(tmp_path, waveform, sr)
-
-                results = list(self.cosyvoice.inference_zero_shot(
-                    text, prompt_text, tmp_path, stream=False
-                ))
-
-            elif mode == "cross_lingual":
-                if not prompt_audio:
-                    raise ValueError("prompt_audio required for cross_lingual mode")
-
-                waveform, sr = self._load_audio(prompt_audio)
-                tmp_path = "/tmp/prompt.wav"
-                torchaudio.save(tmp_path, waveform, sr)
-
-                results = list(self.cosyvoice.inference_cross_lingual(
-                    text, tmp_path, stream=False
-                ))
-
-            elif mode == "instruct":
-                if not prompt_audio or not instruct_text:
-                    raise ValueError("prompt_audio and instruct_text required")
-
-                waveform, sr = self._load_audio(prompt_audio)
-                tmp_path = "/tmp/prompt.wav"
-                torchaudio.save(tmp_path, waveform, sr)
+            audio_chunks = list(self._inference(
+                text, mode, speaker_id, prompt_audio, prompt_text, instruct_text,
+                stream=False,
+            ))
 
-                results = list(self.cosyvoice.inference_instruct2(
-                    text, instruct_text, tmp_path, stream=False
-                ))
-
-            else:  # SFT mode
-                spk = speaker_id or self.cosyvoice.list_available_spks()[0]
-                results = list(self.cosyvoice.inference_sft(
-                    text, spk, stream=False
-                ))
-
-            if not results:
+            if not audio_chunks:
                 raise ValueError("No audio generated")
 
             # Combine audio chunks
-            audio_chunks = [r["tts_speech"] for r in results]
             combined = torch.cat(audio_chunks, dim=1)
 
             # Apply speed adjustment
-            if speed != 1.0 and speed > 0:
-                effects = [["tempo", str(speed)]]
-                combined, _ = torchaudio.sox_effects.apply_effects_tensor(
-                    combined, self.sample_rate, effects
-                )
+            combined = self._apply_speed(combined, speed, high_quality_tempo)
 
             # Encode to output format
-            buffer = io.BytesIO()
             if output_format == "mp3":
-                torchaudio.save(buffer, combined, self.sample_rate, format="mp3")
-            else:
-                torchaudio.save(buffer, combined, self.sample_rate, format="wav")
+                return b"".join(self._mp3_frames([combined]))
 
+            buffer = io.BytesIO()
+            torchaudio.save(buffer, combined, self.sample_rate, format="wav")
             return buffer.getvalue()
 
         except Exception as e:
             print(f"CosyVoice synthesis error: {e}")
             raise
 
+    @modal.method()
+    def synthesize_stream(
+        self,
+        text: str,
+        mode: str = "sft",
+        speaker_id: str = "",
+        prompt_audio: str | None = None,
+        prompt_text: str = "",
+        instruct_text: str = "",
+    ):
+        """
+        Synthesize speech as a stream of MP3 bytes.
+
+        Each chunk CosyVoice produces is encoded and yielded as soon as it
+        arrives, so the first audio reaches the client after the first chunk
+        rather than after the whole utterance. Takes the same arguments as
+        synthesize minus output_format and the speed options: stretching
+        chunks independently clicks at every boundary, so speed changes go
+        through synthesize.
+        """
+        try:
+            chunks = self._inference(
+                text, mode, speaker_id, prompt_audio, prompt_text, instruct_text,
+                stream=True,
+            )
+            yield from self._mp3_frames(chunks)
+
+        except Exception as e:
+            print(f"CosyVoice stream synthesis error: {e}")
+            raise
+
     @modal.method()
     def get_speakers(self) -> list[str]:
         """List available preset speakers."""
@@ -226,7 +418,7 @@ class CosyVoiceTTS:
 @modal.asgi_app()
 def api():
     from fastapi import FastAPI, HTTPException
-    from fastapi.responses import Response
+    from fastapi.responses import Response, StreamingResponse
     from pydantic import BaseModel
 
     web_app = FastAPI(title="CosyVoice TTS API")
@@ -241,12 +433,44 @@ def api():
         instruct_text: str = ""
         speed: float = 1.0
         output_format: str = "mp3"
+        high_quality_tempo: bool = False
 
     @web_app.post("/synthesize")
     async def synthesize(req: SynthesizeRequest):
         """Synthesize speech from text."""
         try:
-            audio_bytes = cosyvoice_tts.synthesize.remote(
+            check_mode_args(req.mode, req.prompt_audio, req.instruct_text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if req.output_format == "mp3" and req.speed == 1.0:
+            # Stream MP3 frames as each chunk is synthesized
+            chunks = cosyvoice_tts.synthesize_stream.remote_gen.aio(
+                text=req.text,
+                mode=req.mode,
+                speaker_id=req.speaker_id,
+                prompt_audio=req.prompt_audio,
+                prompt_text=req.prompt_text,
+                instruct_text=req.instruct_text,
+            )
+            # Pull the first frame before committing to a 200 so synthesis
+            # errors still surface as a proper status code
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                raise HTTPException(status_code=500, detail="No audio generated")
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+            async def body():
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+
+            return StreamingResponse(body(), media_type="audio/mpeg")
+
+        try:
+            audio_bytes = await cosyvoice_tts.synthesize.remote.aio(
                 text=req.text,
                 mode=req.mode,
                 speaker_id=req.speaker_id,
@@ -255,6 +479,7 @@ def api():
                 instruct_text=req.instruct_text,
                 speed=req.speed,
                 output_format=req.output_format,
+                high_quality_tempo=req.high_quality_tempo,
             )
             media_type = "audio/mpeg" if req.output_format == "mp3" else "audio/wav"
             return Response(content=audio_bytes, media_type=media_type)
@@ -264,12 +489,12 @@ def api():
     @web_app.get("/speakers")
     async def speakers():
         """List available speakers."""
-        return {"speakers": cosyvoice_tts.get_speakers.remote()}
+        return {"speakers": await cosyvoice_tts.get_speakers.remote.aio()}
 
     @web_app.get("/health")
     async def health():
         """Health check."""
-        return cosyvoice_tts.health.remote()
+        return await cosyvoice_tts.health.remote.aio()
 
     return web_app
 
@@ -13,8 +13,9 @@ Cost: ~$1.10/hour (A10G) when running, $0 when idle.
 License: CC BY-NC 4.0 (research use only).
 """
 
+import asyncio
 import modal
-import subprocess
+import re
 import sys
 
 # ---------------------------------------------------------------------------
@@ -41,6 +42,11 @@ moshi_image = (
 
 app = modal.App("j-moshi", image=moshi_image)
 
+URL_TIMEOUT_SECS = 300  # Model load (~1-2 min) + tunnel setup
+
+_LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+_GRADIO_URL_RE = re.compile(r"https://[a-zA-Z0-9\-]+\.gradio\.live")
+
 
 # ---------------------------------------------------------------------------
 # Server function — launches moshi.server with Gradio tunnel
@@ -50,10 +56,10 @@ app = modal.App("j-moshi", image=moshi_image)
     timeout=7200,        # 2 hours max session
     scaledown_window=300,
 )
-def run_server():
+async def run_server():
     """Launch J-Moshi server with Gradio tunnel for public access."""
     import os
-    import re
+    import signal
     import tempfile
 
     print("Starting J-Moshi server...")
@@ -73,47 +79,79 @@ def run_server():
 
     print(f"Command: {' '.join(cmd)}")
 
-    process = subprocess.Popen(
-        cmd,
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
         env=os.environ.copy(),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        bufsize=1,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
     )
 
-    gradio_url = None
-    for line in process.stdout:
-        print(line.rstrip())
+    loop = asyncio.get_running_loop()
+    url_future = loop.create_future()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # not on the main thread; fall back to waiting on the process
+
+    def handle_line(line):
+        print(line)
+
+        if url_future.done():
+            return
 
         # Extract Gradio tunnel URL
-        if "Running on public URL:" in line or "gradio.live" in line:
-            match = re.search(r"https://[a-zA-Z0-9\-]+\.gradio\.live", line)
-            if match:
-                gradio_url = match.group(0)
-                print(f"\n=== J-Moshi ready ===")
-                print(f"URL: {gradio_url}")
-                print(f"Use headphones to avoid echo.\n")
-                break
+        match = _GRADIO_URL_RE.search(line)
+        if match:
+            url_future.set_result(match.group(0))
+            print(f"\n=== J-Moshi ready ===")
+            print(f"URL: {match.group(0)}")
+            print(f"Use headphones to avoid echo.\n")
 
         if "Access the Web UI" in line:
             print("Waiting for tunnel URL...")
 
-    if gradio_url:
-        try:
-            process.wait()
-        except KeyboardInterrupt:
-            print("Stopping server...")
-            process.terminate()
-            process.wait()
-    else:
+    async def pump_output():
+        # Keep draining after the URL is found so the child never blocks on a full pipe.
+        # Raw reads split on \r as well as \n: download progress bars redraw with
+        # bare \r, which would overrun readline()'s 64 KiB line limit.
+        pending = b""
+        while True:
+            data = await process.stdout.read(65536)
+            if not data:
+                break
+            *lines, pending = _LINE_BREAK_RE.split(pending + data)
+            for raw in lines:
+                if raw:
+                    handle_line(raw.decode(errors="replace").rstrip())
+        if pending:
+            handle_line(pending.decode(errors="replace").rstrip())
+
+        if not url_future.done():
+            url_future.set_result(None)
+
+    pump = asyncio.create_task(pump_output())
+
+    try:
+        gradio_url = await asyncio.wait_for(asyncio.shield(url_future), URL_TIMEOUT_SECS)
+    except asyncio.TimeoutError:
+        gradio_url = None
+
+    if not gradio_url:
         print("Failed to get Gradio tunnel URL. Check logs.")
         # Keep running anyway — might still be accessible
-        try:
-            process.wait()
-        except KeyboardInterrupt:
-            process.terminate()
-            process.wait()
+
+    exited = asyncio.create_task(process.wait())
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait({exited, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    stopped.cancel()
+
+    if process.returncode is None:
+        print("Stopping server...")
+        process.terminate()
+        await process.wait()
+    await pump
 
     return gradio_url
 
@@ -7,11 +7,13 @@ Logs:    modal app logs kokoro-tts
 
 Exposes:
   POST /synthesize  — JSON body: { text, voice?, lang?, speed?, format? }
-                      Returns: audio/mpeg or audio/wav bytes
+                      Returns: audio/mpeg, audio/ogg (Opus) or audio/wav bytes
   GET  /health      — Returns model status
   GET  /voices      — Lists available voices per language
 """
-import io
+import re
+import struct
+import subprocess
 import modal
 
 # ---------------------------------------------------------------------------
@@ -30,12 +32,21 @@ kokoro_image = (
         "soundfile",
         "torch",
         "numpy",
-        "pydub",
+        "onnxruntime-gpu",
         "fugashi[unidic]",
         "fastapi[standard]",
+        "msgspec",
     )
     # Download unidic dictionary (required by fugashi for Japanese tokenization)
     .run_commands("python3 -m unidic download")
+    # Pre-download the fp16 ONNX export served through onnxruntime-gpu
+    .run_commands(
+        'python3 -c "'
+        "from huggingface_hub import hf_hub_download; "
+        "hf_hub_download('onnx-community/Kokoro-82M-v1.0-ONNX', 'onnx/model_fp16.onnx'); "
+        "print('Kokoro ONNX downloaded')"
+        '"'
+    )
     # Pre-download model weights and validate pipelines during image build
     .run_commands(
         'python3 -c "'
@@ -86,23 +97,72 @@ VOICE_MAP = {
 }
 
 
+KOKORO_ONNX_REPO = "onnx-community/Kokoro-82M-v1.0-ONNX"
+KOKORO_ONNX_FILE = "onnx/model_fp16.onnx"
+
+# Requests arriving within BATCH_WINDOW_SECS of each other (up to BATCH_MAX)
+# are grouped by (lang, voice, speed) before they reach the GPU worker.
+BATCH_WINDOW_SECS = 0.015
+BATCH_MAX = 8
+
+# Token-length buckets for CUDA-graph capture of the ALBERT encoder; 512 is the
+# model's context length, longer inputs never reach it.
+CUDA_GRAPH_BUCKETS = (64, 128, 256, 512)
+
+
+# Hiragana + katakana, and CJK unified ideographs; scanned by the regex engine
+# rather than a per-character Python loop
+_KANA_RE = re.compile("[\u3040-\u30FF]")
+_CJK_RE = re.compile("[\u4E00-\u9FFF]")
+
+
 def detect_lang(text: str) -> str:
     """Detect language code from text content."""
-    has_kana = any(
-        '\u3040' <= c <= '\u309F' or '\u30A0' <= c <= '\u30FF'
-        for c in text
-    )
-    cjk_count = sum(1 for c in text if '\u4E00' <= c <= '\u9FFF')
-
-    if has_kana or (cjk_count > 0 and any(
-        '\u3040' <= c <= '\u30FF' for c in text
-    )):
+    if _KANA_RE.search(text):
         return "j"
-    if cjk_count > len(text) * 0.2:
+    if len(_CJK_RE.findall(text)) > len(text) * 0.2:
         return "z"
     return "a"
 
 
+# Compressed output formats: ffmpeg encoder args, media type, file extension.
+# Opus at 24k (voip tuning) is far smaller and cheaper to encode than MP3.
+ENCODERS = {
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"], "audio/mpeg", "mp3"),
+    "opus": (["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"], "audio/ogg", "ogg"),
+}
+
+
+def ffmpeg_encode_cmd(sr: int, fmt: str = "mp3") -> list[str]:
+    """ffmpeg argv that encodes mono f32le PCM on stdin to fmt on stdout."""
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "f32le", "-ar", str(sr), "-ac", "1", "-i", "pipe:0",
+        *ENCODERS[fmt][0], "-flush_packets", "1", "pipe:1",
+    ]
+
+
+def pcm16_wav(audio, sr: int) -> bytes:
+    """Mono 16-bit PCM WAV from float samples in [-1, 1]: 44-byte header + data."""
+    pcm = (audio.clip(-1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(pcm), b"WAVE",
+        b"fmt ", 16, 1, 1, sr, sr * 2, 2, 16,
+        b"data", len(pcm),
+    )
+    return header + pcm
+
+
+def negotiate_format(requested: str, accept: str) -> str:
+    """Output format: wav/opus when asked for, Opus when Accept prefers it, else MP3."""
+    if requested in ("wav", "opus"):
+        return requested
+    if "audio/ogg" in accept or "opus" in accept:
+        return "opus"
+    return "mp3"
+
+
 def resolve_voice(lang: str, voice_name: str) -> str:
     """Resolve OpenAI-style voice name to Kokoro voice ID."""
     lang_voices = VOICE_MAP.get(lang, VOICE_MAP["a"])
@@ -127,12 +187,17 @@ def resolve_voice(lang: str, voice_name: str) -> str:
 @modal.asgi_app()
 def web():
     """FastAPI web endpoint for TTS — loads model once at container startup."""
-    from fastapi import FastAPI, HTTPException, Response
+    from fastapi import FastAPI, HTTPException, Request, Response
+    from fastapi.responses import StreamingResponse
     from fastapi.middleware.cors import CORSMiddleware
-    from pydantic import BaseModel, Field
-    from typing import Optional
+    from typing import Annotated, Optional
+    import msgspec
+    import asyncio
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from contextlib import contextmanager
     import numpy as np
-    import soundfile as sf
     import torch
     from kokoro import KPipeline, KModel
 
@@ -145,102 +210,528 @@ def web():
         allow_headers=["*"],
     )
 
-    class SynthesizeRequest(BaseModel):
+    # msgspec rather than Pydantic: decoding + validation happens in one C pass
+    # on the event loop thread
+    class SynthesizeRequest(msgspec.Struct):
         text: str = ""
-        voice: str = Field(default="nova")
-        lang: str = Field(default="")
-        speed: float = Field(default=1.0, ge=0.25, le=4.0)
-        format: str = Field(default="mp3")
+        voice: str = "nova"
+        lang: str = ""
+        speed: Annotated[float, msgspec.Meta(ge=0.25, le=4.0)] = 1.0
+        format: str = "mp3"
         # OpenAI-compatible fields
         input: Optional[str] = None
         model: Optional[str] = None
         instructions: Optional[str] = None
 
+    _decode_request = msgspec.json.Decoder(SynthesizeRequest).decode
+
+    async def parse_request(request: Request) -> SynthesizeRequest:
+        try:
+            return _decode_request(await request.body())
+        except msgspec.DecodeError as e:
+            # Same status FastAPI used for Pydantic validation failures
+            raise HTTPException(422, str(e))
+
     # ---- Eager model loading at import time (container startup) ----
     _device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Loading Kokoro model on {_device}...")
     _model = KModel(repo_id="hexgrad/Kokoro-82M").to(_device).eval()
+    _backend = "torch"
+
+    def _use_onnx_runtime():
+        """Run KModel inference through ONNX Runtime's CUDA provider.
+
+        KPipeline only accepts a KModel, so the model stays in place for its
+        vocab and device; only forward_with_tokens is routed to the session.
+        """
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+
+        if hasattr(ort, "preload_dlls"):
+            # Reuse the CUDA/cuDNN libraries shipped with torch
+            ort.preload_dlls()
+        session = ort.InferenceSession(
+            hf_hub_download(KOKORO_ONNX_REPO, KOKORO_ONNX_FILE),
+            providers=[
+                ("CUDAExecutionProvider", {"device_id": 0, "cudnn_conv_algo_search": "HEURISTIC"}),
+                "CPUExecutionProvider",
+            ],
+        )
+        if "CUDAExecutionProvider" not in session.get_providers():
+            raise RuntimeError("CUDAExecutionProvider not available")
+        inputs = {i.name for i in session.get_inputs()}
+        if inputs != {"input_ids", "style", "speed"}:
+            raise RuntimeError(f"unexpected ONNX inputs: {sorted(inputs)}")
+
+        def forward_with_tokens(input_ids, ref_s, speed=1):
+            audio = session.run(None, {
+                "input_ids": input_ids.cpu().numpy(),
+                "style": ref_s.cpu().numpy().astype(np.float32, copy=False),
+                "speed": np.array([speed], dtype=np.float32),
+            })[0]
+            return torch.from_numpy(audio), None
+
+        _model.forward_with_tokens = forward_with_tokens
+
+    def _phoneme_ids(phonemes: str) -> list[int]:
+        """Token ids for a phoneme string, framed by the pad token (as KModel.forward)."""
+        ids = [0, *(i for i in map(_model.vocab.get, phonemes) if i is not None), 0]
+        assert len(ids) <= _model.context_length, (len(ids), _model.context_length)
+        return ids
+
+    def _use_pinned_inputs():
+        """Stage phoneme ids in one reused pinned buffer for async H2D copies.
+
+        Mirrors KModel.forward, which builds a fresh pageable LongTensor per
+        chunk and so forces a synchronous copy.
+        """
+        staging = torch.empty(_model.context_length, dtype=torch.long, pin_memory=True)
+        staged = staging.numpy()
+        copied = torch.cuda.Event()
+        copied.record()
+
+        def forward(phonemes, ref_s, speed=1, return_output=False):
+            ids = _phoneme_ids(phonemes)
+            # The previous chunk's copy must drain the buffer before it is reused
+            copied.synchronize()
+            staged[:len(ids)] = ids
+            input_ids = staging[:len(ids)].to(_device, non_blocking=True).unsqueeze(0)
+            copied.record()
+            audio, _ = _model.forward_with_tokens(input_ids, ref_s.to(_device), speed)
+            # Audio stays on the device: callers batch the D2H copy. pred_dur is
+            # dropped so KPipeline skips word timestamps, which nothing here uses
+            # and which would sync per chunk.
+            audio = audio.squeeze()
+            return KModel.Output(audio=audio, pred_dur=None) if return_output else audio
+
+        _model.forward = forward
+
+    def _capture_bert_graphs():
+        """Replay the ALBERT encoder from CUDA graphs captured per token bucket.
+
+        At batch 1 the encoder is dominated by kernel-launch overhead. Inputs are
+        zero-padded to the nearest bucket and masked, so the valid positions match
+        eager. Stages after duration prediction have data-dependent shapes (and
+        instance norms that padding would skew), so they stay eager.
+        """
+        bert = _model.bert
+        eager = bert.forward
+        pool = torch.cuda.graph_pool_handle()
+        lock = threading.Lock()
+        graphs = {}
+
+        with torch.no_grad():
+            # Largest first so smaller graphs can reuse the shared pool
+            for n in sorted(CUDA_GRAPH_BUCKETS, reverse=True):
+                ids = torch.zeros((1, n), dtype=torch.long, device=_device)
+                mask = torch.ones((1, n), dtype=torch.int32, device=_device)
+                side = torch.cuda.Stream()
+                side.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(side):
+                    for _ in range(2):
+                        eager(ids, attention_mask=mask)
+                torch.cuda.current_stream().wait_stream(side)
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph, pool=pool):
+                    out = eager(ids, attention_mask=mask)
+                graphs[n] = (graph, ids, mask, out)
+
+        def graphed(input_ids, attention_mask=None, **kwargs):
+            n = input_ids.shape[-1]
+            bucket = next((b for b in CUDA_GRAPH_BUCKETS if b >= n), None)
+            if bucket is None or input_ids.shape[0] != 1 or kwargs or torch.is_grad_enabled():
+                return eager(input_ids, attention_mask=attention_mask, **kwargs)
+            graph, ids, mask, out = graphs[bucket]
+            with lock:
+                ids.zero_()
+                ids[:, :n] = input_ids
+                mask.zero_()
+                mask[:, :n] = 1 if attention_mask is None else attention_mask
+                graph.replay()
+                return out[:, :n].clone()
+
+        bert.forward = graphed
+
+    if _device == "cuda":
+        try:
+            _use_onnx_runtime()
+            _backend = "onnxruntime"
+            print(f"  ONNX Runtime (CUDA) serving {KOKORO_ONNX_FILE}")
+        except Exception as _e:
+            print(f"  ONNX Runtime unavailable (using torch): {_e}")
+
+    if _device == "cuda" and _backend == "torch":
+        # ONNX Runtime reads its inputs from host memory, so staging them on
+        # the device would only add a round trip
+        _use_pinned_inputs()
+
+    if _device == "cuda" and _backend == "torch":
+        try:
+            _capture_bert_graphs()
+            print(f"  CUDA graphs captured for buckets {CUDA_GRAPH_BUCKETS}")
+        except Exception as _e:
+            print(f"  CUDA graph capture failed (using eager): {_e}")
+
+    @contextmanager
+    def _inference_ctx():
+        """inference_mode plus fp16 autocast: conv/matmul run on tensor cores."""
+        with torch.inference_mode(), torch.autocast(
+            "cuda", dtype=torch.float16, enabled=_device == "cuda"
+        ):
+            yield
+
+    def _compile_decoder(pipeline):
+        """torch.compile the iSTFTNet decoder and warm it up on a short phrase.
+
+        STFT/iSTFT are pinned to fp32: cuFFT has no half-precision path for
+        Kokoro's non-power-of-two n_fft.
+        """
+        eager = _model.decoder
+        stft = eager.generator.stft
+
+        def fp32(fn):
+            def wrapped(*args):
+                with torch.autocast("cuda", enabled=False):
+                    return fn(*(a.float() for a in args))
+            return wrapped
+
+        stft.transform = fp32(stft.transform)
+        stft.inverse = fp32(stft.inverse)
+        _model.decoder = torch.compile(eager, dynamic=True)
+        try:
+            with _inference_ctx():
+                for _ in pipeline("Warm up.", voice=VOICE_MAP["a"]["default"]):
+                    pass
+        except Exception:
+            _model.decoder = eager
+            raise
+
+    def _warm_voices(lang: str, pipeline):
+        """Load the language's mapped voice packs onto the device up front.
+
+        KPipeline caches packs on the CPU and moves them per call; storing the
+        device copy in its cache makes that .to() a no-op. ONNX Runtime takes
+        the style vector from host memory, so its packs stay on the CPU.
+        """
+        device = _device if _backend == "torch" else "cpu"
+        for voice_id in set(VOICE_MAP.get(lang, {}).values()):
+            try:
+                pipeline.voices[voice_id] = pipeline.load_voice(voice_id).to(device)
+            except Exception as e:
+                print(f"  Voice '{voice_id}' preload failed: {e}")
+
     _pipelines: dict = {}
     for _lc in ["a", "j"]:
         try:
             _pipelines[_lc] = KPipeline(lang_code=_lc, model=_model, device=_device)
+            _warm_voices(_lc, _pipelines[_lc])
             print(f"  Pipeline '{_lc}' ready")
         except Exception as _e:
             print(f"  Pipeline '{_lc}' failed: {_e}")
+    if _device == "cuda" and _backend == "torch" and "a" in _pipelines:
+        try:
+            _compile_decoder(_pipelines["a"])
+            print("  Decoder compiled (fp16 autocast)")
+        except Exception as _e:
+            print(f"  Decoder compile failed (using eager): {_e}")
     print("Kokoro TTS loaded")
 
     def _get_pipeline(lang: str):
         if lang not in _pipelines:
-            _pipelines[lang] = KPipeline(lang_code=lang, model=_model, device=_device)
+            pipeline = KPipeline(lang_code=lang, model=_model, device=_device)
+            _warm_voices(lang, pipeline)
+            _pipelines[lang] = pipeline
         return _pipelines[lang]
 
-    def do_synthesize(text: str, voice: str, lang: str, speed: float, output_format: str):
+    def _audio_chunks(text: str, voice: str, lang: str, speed: float):
+        """Yield each pipeline segment's audio as it is generated."""
+        if not lang:
+            lang = detect_lang(text)
+        voice_id = resolve_voice(lang, voice)
+        pipeline = _get_pipeline(lang)
+
+        with _inference_ctx():
+            for result in pipeline(text, voice=voice_id, speed=speed):
+                if hasattr(result, "audio") and result.audio is not None:
+                    yield torch.as_tensor(result.audio).float().reshape(-1)
+
+    def _forward_from_bert(input_ids, bert_dur, ref_s, speed: float):
+        """KModel.forward_with_tokens from the ALBERT output onward, batch 1."""
+        m = _model
+        n = input_ids.shape[-1]
+        input_lengths = torch.full((1,), n, device=_device, dtype=torch.long)
+        text_mask = torch.zeros((1, n), dtype=torch.bool, device=_device)
+        d_en = m.bert_encoder(bert_dur).transpose(-1, -2)
+        s = ref_s[:, 128:]
+        d = m.predictor.text_encoder(d_en, s, input_lengths, text_mask)
+        x, _ = m.predictor.lstm(d)
+        duration = torch.sigmoid(m.predictor.duration_proj(x)).sum(axis=-1) / speed
+        pred_dur = torch.round(duration).clamp(min=1).long().squeeze()
+        indices = torch.repeat_interleave(torch.arange(n, device=_device), pred_dur)
+        pred_aln_trg = torch.zeros((n, indices.shape[0]), device=_device)
+        pred_aln_trg[indices, torch.arange(indices.shape[0])] = 1
+        pred_aln_trg = pred_aln_trg.unsqueeze(0)
+        en = d.transpose(-1, -2) @ pred_aln_trg
+        F0_pred, N_pred = m.predictor.F0Ntrain(en, s)
+        t_en = m.text_encoder(input_ids, input_lengths, text_mask)
+        asr = t_en @ pred_aln_trg
+        return m.decoder(asr, F0_pred, N_pred, ref_s[:, :128]).squeeze()
+
+    def _batched_chunks(text: str, voice: str, lang: str, speed: float):
+        """Like _audio_chunks, but runs ALBERT once over every segment.
+
+        A first pass through the pipeline only records each segment's phonemes
+        and voice slice. Their ids are padded to a shared bucket and masked, so
+        one encoder forward serves the whole utterance; the duration-dependent
+        remainder of the model then runs per segment.
+        """
         if not lang:
             lang = detect_lang(text)
         voice_id = resolve_voice(lang, voice)
         pipeline = _get_pipeline(lang)
 
-        audio_chunks = []
-        for result in pipeline(text, voice=voice_id, speed=speed):
-            if hasattr(result, "audio") and result.audio is not None:
-                if isinstance(result.audio, torch.Tensor):
-                    audio_chunks.append(result.audio.cpu().numpy())
-                else:
-                    audio_chunks.append(np.array(result.audio))
+        segments = []
 
-        if not audio_chunks:
+        def record(phonemes, ref_s, speed=1, return_output=False):
+            segments.append((_phoneme_ids(phonemes), ref_s, speed))
+            empty = torch.zeros(0)
+            return KModel.Output(audio=empty, pred_dur=None) if return_output else empty
+
+        forward = _model.forward
+        _model.forward = record
+        try:
+            for _ in pipeline(text, voice=voice_id, speed=speed):
+                pass
+        finally:
+            _model.forward = forward
+        if not segments:
+            return
+
+        longest = max(len(ids) for ids, _, _ in segments)
+        width = next((b for b in CUDA_GRAPH_BUCKETS if b >= longest), longest)
+        batch = torch.zeros((len(segments), width), dtype=torch.long)
+        mask = torch.zeros((len(segments), width), dtype=torch.int32)
+        for row, (ids, _, _) in enumerate(segments):
+            batch[row, :len(ids)] = torch.tensor(ids)
+            mask[row, :len(ids)] = 1
+        pinned = _device == "cuda"
+        if pinned:
+            batch, mask = batch.pin_memory(), mask.pin_memory()
+        batch = batch.to(_device, non_blocking=pinned)
+        mask = mask.to(_device, non_blocking=pinned)
+
+        with _inference_ctx():
+            bert_out = _model.bert(batch, attention_mask=mask)
+            for row, (ids, ref_s, seg_speed) in enumerate(segments):
+                n = len(ids)
+                audio = _forward_from_bert(
+                    batch[row:row + 1, :n], bert_out[row:row + 1, :n],
+                    ref_s.to(_device), seg_speed,
+                )
+                yield audio.float().reshape(-1)
+
+    # Pinned host buffer the whole utterance is copied into; grown on demand.
+    # Only the GPU worker thread touches it.
+    _host_audio = [torch.empty(24000 * 60, pin_memory=_device == "cuda")]
+
+    def _host_buffer(size: int, filled: int):
+        buf = _host_audio[0]
+        if size > buf.numel():
+            if _device == "cuda":
+                torch.cuda.synchronize()  # in-flight copies must land first
+            grown = torch.empty(max(size, 2 * buf.numel()), pin_memory=_device == "cuda")
+            grown[:filled] = buf[:filled]
+            _host_audio[0] = buf = grown
+        return buf
+
+    def render_audio(text: str, voice: str, lang: str, speed: float) -> np.ndarray:
+        """Synthesize the whole utterance; runs on the GPU worker."""
+        # Queue every chunk's D2H copy asynchronously and sync once at the end
+        # The ONNX graph fuses the encoder already; batching needs the torch model
+        chunks = _batched_chunks if _backend == "torch" else _audio_chunks
+        filled = 0
+        for chunk in chunks(text, voice, lang, speed):
+            n = chunk.numel()
+            _host_buffer(filled + n, filled)[filled:filled + n].copy_(chunk, non_blocking=True)
+            filled += n
+        if not filled:
             raise RuntimeError("No audio generated")
+        if _device == "cuda":
+            torch.cuda.synchronize()
+
+        return _host_audio[0][:filled].numpy().copy()
+
+    # ---- GPU job queue ----
+    # One worker thread owns the pipeline, so concurrent requests queue rather
+    # than interleave kernels, and the event loop stays free while they wait.
+    _gpu_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kokoro-gpu")
+    _jobs: asyncio.Queue = asyncio.Queue()
+    _batcher_task = None
+
+    def _settle(future, result=None, error=None):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _batcher():
+        """Collect jobs filed within a short window and run them grouped.
+
+        KModel runs one sequence per forward (durations are expanded with
+        repeat_interleave over a single utterance), so a group runs back to
+        back on the warm voice pack rather than as one padded forward.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await _jobs.get()]
+            deadline = loop.time() + BATCH_WINDOW_SECS
+            while len(batch) < BATCH_MAX and (remaining := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(_jobs.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch.sort(key=lambda job: job[0])
+            for _, fn, future in batch:
+                try:
+                    _settle(future, await loop.run_in_executor(_gpu_worker, fn))
+                except Exception as e:
+                    _settle(future, error=e)
+
+    def submit(voice: str, lang: str, speed: float, fn):
+        """Queue fn for the GPU worker; returns a future for its result."""
+        nonlocal _batcher_task
+        if _batcher_task is None:
+            _batcher_task = asyncio.create_task(_batcher())
+        future = asyncio.get_running_loop().create_future()
+        _jobs.put_nowait(((lang, resolve_voice(lang, voice), speed), fn, future))
+        return future
+
+    async def synthesize_wav(text: str, voice: str, lang: str, speed: float) -> bytes:
+        """Render the whole utterance as WAV; compressed formats go through stream_encoded."""
+        lang = lang or detect_lang(text)
+        audio = await submit(
+            voice, lang, speed,
+            lambda: render_audio(text, voice, lang, speed),
+        )
+        # The GPU worker moves on to the next job while this encodes
+        return await asyncio.to_thread(pcm16_wav, audio, 24000)
+
+    async def stream_encoded(text: str, voice: str, lang: str, speed: float, fmt: str):
+        """Return an iterator of encoded bytes once the first segment is synthesized.
+
+        The GPU worker queues each segment's PCM and a writer thread pipes it
+        into a single ffmpeg process, so a slow client only stalls the writer,
+        never the GPU worker. The returned iterator drains ffmpeg's stdout as
+        frames are encoded.
+        """
+        loop = asyncio.get_running_loop()
+        lang = lang or detect_lang(text)
+        proc = subprocess.Popen(
+            ffmpeg_encode_cmd(24000, fmt),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        first_chunk = loop.create_future()
+        # PCM segments for the writer; None marks the end
+        pcm: queue.SimpleQueue = queue.SimpleQueue()
+        client_gone = threading.Event()
+
+        def write_stdin():
+            try:
+                while (data := pcm.get()) is not None:
+                    proc.stdin.write(data)
+            except OSError:
+                # ffmpeg was killed because the client went away
+                client_gone.set()
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+        threading.Thread(target=write_stdin, daemon=True, name="kokoro-ffmpeg-feed").start()
+
+        def feed():
+            started, error = False, None
+            try:
+                for chunk in _audio_chunks(text, voice, lang, speed):
+                    if client_gone.is_set():
+                        break
+                    if not started:
+                        started = True
+                        loop.call_soon_threadsafe(_settle, first_chunk)
+                    pcm.put(chunk.cpu().numpy().tobytes())
+            except Exception as e:
+                error = e
+            finally:
+                pcm.put(None)
+            if not started:
+                error = error or RuntimeError("No audio generated")
+                loop.call_soon_threadsafe(_settle, first_chunk, None, error)
+
+        submit(voice, lang, speed, feed)
+        try:
+            await first_chunk
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+
+        def drain():
+            try:
+                while data := proc.stdout.read1(8192):
+                    yield data
+            finally:
+                # Client went away mid-stream: stop ffmpeg so the writer exits
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
 
-        audio = np.concatenate(audio_chunks)
-        buffer = io.BytesIO()
-        if output_format == "wav":
-            sf.write(buffer, audio, 24000, format="WAV")
-            content_type = "audio/wav"
-        else:
-            wav_buf = io.BytesIO()
-            sf.write(wav_buf, audio, 24000, format="WAV")
-            wav_buf.seek(0)
-            from pydub import AudioSegment
-            seg = AudioSegment.from_wav(wav_buf)
-            seg.export(buffer, format="mp3", bitrate="128k")
-            content_type = "audio/mpeg"
-
-        return buffer.getvalue(), content_type
+        return drain()
 
     @fastapi_app.post("/synthesize")
-    async def synthesize(req: SynthesizeRequest):
+    async def synthesize(request: Request):
+        req = await parse_request(request)
         text = req.input or req.text
-        if not text or not text.strip():
+        if not text or text.isspace():
             raise HTTPException(400, "text is required")
         if len(text) > 4096:
             raise HTTPException(400, "text must be under 4096 characters")
+        fmt = negotiate_format(req.format, request.headers.get("accept", ""))
+        ext = ENCODERS[fmt][2] if fmt in ENCODERS else fmt
+        headers = {"Content-Disposition": f'inline; filename="speech.{ext}"'}
         try:
-            audio_bytes, content_type = do_synthesize(
-                text, req.voice, req.lang, req.speed, req.format
-            )
-            return Response(
-                content=audio_bytes,
-                media_type=content_type,
-                headers={
-                    "Content-Disposition": f'inline; filename="speech.{req.format}"',
-                },
-            )
+            if fmt in ENCODERS:
+                return StreamingResponse(
+                    await stream_encoded(text, req.voice, req.lang, req.speed, fmt),
+                    media_type=ENCODERS[fmt][1],
+                    headers=headers,
+                )
+            audio_bytes = await synthesize_wav(text, req.voice, req.lang, req.speed)
+            return Response(content=audio_bytes, media_type="audio/wav", headers=headers)
         except Exception as e:
             raise HTTPException(500, f"TTS failed: {str(e)}")
 
     # OpenAI-compatible endpoint
     @fastapi_app.post("/v1/audio/speech")
-    async def openai_compat(req: SynthesizeRequest):
+    async def openai_compat(request: Request):
+        req = await parse_request(request)
         text = req.input or req.text
-        if not text or not text.strip():
+        if not text or text.isspace():
             raise HTTPException(400, "input is required")
         if len(text) > 4096:
             raise HTTPException(400, "input must be under 4096 characters")
+        fmt = negotiate_format(req.format, request.headers.get("accept", ""))
         try:
-            audio_bytes, content_type = do_synthesize(
-                text, req.voice, req.lang, req.speed, req.format
-            )
-            return Response(content=audio_bytes, media_type=content_type)
+            if fmt in ENCODERS:
+                return StreamingResponse(
+                    await stream_encoded(text, req.voice, req.lang, req.speed, fmt),
+                    media_type=ENCODERS[fmt][1],
+                )
+            audio_bytes = await synthesize_wav(text, req.voice, req.lang, req.speed)
+            return Response(content=audio_bytes, media_type="audio/wav")
         except Exception as e:
             raise HTTPException(500, f"TTS failed: {str(e)}")
 
@@ -250,6 +741,7 @@ def web():
             "status": "ok",
             "model": "Kokoro-82M",
             "device": _device,
+            "backend": _backend,
             "languages": list(_pipelines.keys()),
         }
 
@@ -8,15 +8,15 @@ Logs:    modal app logs voice-clone-tts
 Exposes:
   POST /tts       — Synthesize speech with a selected voice (voice_id parameter)
                     Body: { text, voice_id?, speed?, format? }
-                    Returns: audio/mpeg bytes
+                    Returns: audio/mpeg bytes (audio/ogg Opus for format="opus")
   POST /clone     — Upload audio sample to create a new cloned voice
                     Body: { audio_base64, name?, prompt_text? }
                     Returns: JSON { voice_id, name, type }
   GET  /voices    — List available preset voices
   GET  /health    — Health check
 """
-import io
 import os
+import subprocess
 import modal
 
 # ---------------------------------------------------------------------------
@@ -32,13 +32,13 @@ fish_speech_image = (
         "torchaudio",
         "numpy",
         "soundfile",
-        "pydub",
         "fastapi",
         "uvicorn",
         "python-multipart",
         "transformers>=4.36",
         "encodec",
         "huggingface_hub",
+        "torchao",
     )
     # Install Fish Speech
     .run_commands(
@@ -56,6 +56,17 @@ fish_speech_image = (
 
 app = modal.App("voice-clone-tts", image=fish_speech_image)
 
+# Generation budget: semantic tokens scale with text length, so short utterances
+# get a proportionally short ceiling instead of the full MAX_NEW_TOKENS.
+MAX_NEW_TOKENS = 2048
+TOKENS_PER_CHAR = 20
+
+# ffmpeg encoder args per output codec; Opus at 24k is much cheaper than MP3
+ENCODER_ARGS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"],
+    "opus": ["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"],
+}
+
 # Volume for storing cloned voice references
 voice_volume = modal.Volume.from_name("voice-clone-data", create_if_missing=True)
 
@@ -165,14 +176,15 @@ def web():
     import base64
     import hashlib
     import json
+    import shutil
+    import tempfile
     import time
     import uuid
     from pathlib import Path
 
     import numpy as np
-    import soundfile as sf
     import torch
-    import torchaudio
+    from torch.nn.attention import SDPBackend, sdpa_kernel
     from fastapi import FastAPI, HTTPException, Response
     from fastapi.middleware.cors import CORSMiddleware
     from pydantic import BaseModel, Field
@@ -215,6 +227,26 @@ def web():
     _model = None
     _tokenizer = None
     _model_loaded = False
+    _eos_token_ids: list = []
+
+    def _quantize_weights(model):
+        """Int8 weight-only quantization of the Linear layers (torchao).
+
+        Batch-1 decoding is bound by weight bandwidth, so halving the bytes read
+        per token matters more than the dequant cost. Keeps fp16 on failure.
+        """
+        try:
+            from torchao.quantization import quantize_
+            try:
+                from torchao.quantization import Int8WeightOnlyConfig
+                config = Int8WeightOnlyConfig()
+            except ImportError:
+                from torchao.quantization import int8_weight_only
+                config = int8_weight_only()
+            quantize_(model, config)
+            print("Fish Speech weights quantized to int8 (weight-only)")
+        except Exception as e:
+            print(f"Int8 quantization skipped (keeping fp16): {e}")
 
     try:
         from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -225,8 +257,23 @@ def web():
             torch_dtype=torch.float16 if _device == "cuda" else torch.float32,
             trust_remote_code=True,
         ).to(_device).eval()
+        # KV cache follows the fp16 weights; never materialize attention maps
+        _model.config.use_cache = True
+        _model.config.output_attentions = False
+        _model.config.output_hidden_states = False
+        if _device == "cuda":
+            _quantize_weights(_model)
         _model_loaded = True
         print("Fish Speech 1.5 model loaded successfully")
+        # Stop on the tokenizer's EOS or the chat-style end-of-turn token the
+        # codec stream is terminated with, whichever the vocab defines.
+        _eos_token_ids = sorted({
+            tid for tid in (
+                _tokenizer.eos_token_id,
+                _tokenizer.convert_tokens_to_ids("<|im_end|>"),
+            )
+            if tid is not None and tid != _tokenizer.unk_token_id
+        })
     except Exception as e:
         print(f"Fish Speech load error (will use fallback): {e}")
         _model_loaded = False
@@ -245,56 +292,49 @@ def web():
             return json.loads(meta_path.read_text())
         return None
 
-    def _load_reference_audio(voice_id: str) -> Optional[tuple]:
-        """Load reference audio for a voice (for voice cloning TTS)."""
-        voice_dir = VOICE_DIR / voice_id
-        ref_path = voice_dir / "reference.wav"
-        if ref_path.exists():
-            waveform, sr = torchaudio.load(str(ref_path))
-            return waveform, sr
-        return None
+    def _generate(inputs, text_len: int):
+        """Sample codec tokens, preferring fused (flash / mem-efficient) attention."""
+        kwargs = dict(
+            **inputs,
+            max_new_tokens=min(MAX_NEW_TOKENS, text_len * TOKENS_PER_CHAR),
+            eos_token_id=_eos_token_ids or None,
+            use_cache=True,
+            output_attentions=False,
+            output_hidden_states=False,
+            do_sample=True,
+            temperature=0.7,
+            top_p=0.9,
+        )
+        if _device != "cuda":
+            return _model.generate(**kwargs)
+        try:
+            with sdpa_kernel([SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION]):
+                return _model.generate(**kwargs)
+        except RuntimeError as e:
+            # Shapes/masks neither fused kernel supports: fall back to math
+            print(f"Fused SDPA unavailable, retrying with default backends: {e}")
+            return _model.generate(**kwargs)
 
     def _synthesize_with_model(
         text: str,
         voice_id: str = "ja_female_warm",
         speed: float = 1.0,
         reference_audio: Optional[bytes] = None,
+        codec: str = "mp3",
     ) -> bytes:
         """Synthesize speech using the loaded model."""
         # If model not loaded, generate a simple sine wave tone as fallback
         if not _model_loaded:
-            return _fallback_synthesize(text)
+            return _fallback_synthesize(text, codec)
 
         try:
             # Try Fish Speech inference
-            # Fish Speech uses a codec-based approach
-            if reference_audio:
-                # Zero-shot voice cloning with reference audio
-                ref_buf = io.BytesIO(reference_audio)
-                ref_waveform, ref_sr = torchaudio.load(ref_buf)
-                if ref_sr != 16000:
-                    ref_waveform = torchaudio.functional.resample(ref_waveform, ref_sr, 16000)
-            else:
-                # Try to load stored reference for this voice_id
-                ref_data = _load_reference_audio(voice_id)
-                if ref_data:
-                    ref_waveform, ref_sr = ref_data
-                    if ref_sr != 16000:
-                        ref_waveform = torchaudio.functional.resample(ref_waveform, ref_sr, 16000)
-                else:
-                    ref_waveform = None
-
-            # Generate using the model
+            # Fish Speech uses a codec-based approach. generate() here takes no
+            # speaker conditioning, so reference audio is not loaded per request.
             inputs = _tokenizer(text, return_tensors="pt").to(_device)
 
-            with torch.no_grad():
-                outputs = _model.generate(
-                    **inputs,
-                    max_new_tokens=2048,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9,
-                )
+            with torch.inference_mode():
+                outputs = _generate(inputs, len(text))
 
             # Decode output tokens to audio
             audio_tokens = outputs[0][inputs["input_ids"].shape[1]:]
@@ -304,7 +344,8 @@ def web():
             if hasattr(_model, 'decode') or hasattr(_model, 'decode_audio'):
                 decoder = getattr(_model, 'decode', getattr(_model, 'decode_audio', None))
                 if decoder:
-                    audio = decoder(audio_tokens.unsqueeze(0))
+                    with torch.inference_mode():
+                        audio = decoder(audio_tokens.unsqueeze(0))
                     if isinstance(audio, torch.Tensor):
                         audio = audio.cpu().numpy().flatten()
                     else:
@@ -314,18 +355,12 @@ def web():
             else:
                 audio = _generate_speech_fallback(text)
 
-            # Apply speed adjustment
-            if speed != 1.0:
-                import torchaudio.functional as F
-                audio_tensor = torch.from_numpy(audio).unsqueeze(0)
-                audio_tensor = F.speed(audio_tensor, 24000, speed)[0]
-                audio = audio_tensor.numpy().flatten()
-
-            return _audio_to_mp3(audio, 24000)
+            # Speed adjustment happens in the encoder's atempo filter
+            return _encode_audio(audio, 24000, speed, codec)
 
         except Exception as e:
             print(f"Model synthesis error: {e}")
-            return _fallback_synthesize(text)
+            return _fallback_synthesize(text, codec)
 
     def _generate_speech_fallback(text: str) -> np.ndarray:
         """Generate speech using a simpler TTS method as fallback."""
@@ -338,47 +373,60 @@ def web():
         audio = np.sin(2 * np.pi * 220 * t) * 0.1  # Very quiet A3 note
         return audio.astype(np.float32)
 
-    def _fallback_synthesize(text: str) -> bytes:
+    def _fallback_synthesize(text: str, codec: str = "mp3") -> bytes:
         """Minimal fallback when model is not available."""
         audio = _generate_speech_fallback(text)
-        return _audio_to_mp3(audio, 24000)
-
-    def _audio_to_mp3(audio: np.ndarray, sample_rate: int = 24000) -> bytes:
-        """Convert numpy audio array to MP3 bytes."""
-        wav_buf = io.BytesIO()
-        sf.write(wav_buf, audio, sample_rate, format="WAV")
-        wav_buf.seek(0)
-        from pydub import AudioSegment
-        seg = AudioSegment.from_wav(wav_buf)
-        mp3_buf = io.BytesIO()
-        seg.export(mp3_buf, format="mp3", bitrate="128k")
-        return mp3_buf.getvalue()
+        return _encode_audio(audio, 24000, codec=codec)
+
+    def _encode_audio(
+        audio: np.ndarray, sample_rate: int = 24000, speed: float = 1.0, codec: str = "mp3"
+    ) -> bytes:
+        """Convert numpy audio array to MP3/Opus bytes by piping raw f32le through ffmpeg.
+
+        speed != 1.0 is applied with ffmpeg's pitch-preserving atempo filter in
+        the same process.
+        """
+        tempo = ["-af", f"atempo={speed}"] if speed != 1.0 else []
+        proc = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-f", "f32le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+                *tempo,
+                *ENCODER_ARGS[codec], "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate(audio.astype(np.float32, copy=False).tobytes())
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg {codec} encode failed: {err.decode(errors='replace').strip()}")
+        return out
 
     def _decode_audio_base64(audio_b64: str) -> bytes:
-        """Decode base64 audio and convert to WAV bytes."""
+        """Decode base64 audio (any ffmpeg-readable format) to 16 kHz mono WAV bytes."""
         raw = base64.b64decode(audio_b64)
-        # Try to load as any audio format and convert to WAV
-        try:
-            buf = io.BytesIO(raw)
-            from pydub import AudioSegment
-            # Try different formats
-            for fmt in ["webm", "ogg", "mp3", "wav", "m4a"]:
-                try:
-                    buf.seek(0)
-                    seg = AudioSegment.from_file(buf, format=fmt)
-                    wav_buf = io.BytesIO()
-                    seg.export(wav_buf, format="wav")
-                    return wav_buf.getvalue()
-                except Exception:
-                    continue
-            # If all formats fail, try raw
-            buf.seek(0)
-            seg = AudioSegment.from_file(buf)
-            wav_buf = io.BytesIO()
-            seg.export(wav_buf, format="wav")
-            return wav_buf.getvalue()
-        except Exception as e:
-            raise ValueError(f"Failed to decode audio: {e}")
+        # Real files rather than pipes: MP4/M4A input needs seeking, and a piped
+        # WAV would carry placeholder RIFF sizes
+        with tempfile.NamedTemporaryFile(suffix=".audio") as src, \
+                tempfile.NamedTemporaryFile(suffix=".wav") as dst:
+            src.write(raw)
+            src.flush()
+            probe = subprocess.run(
+                ["ffprobe", "-v", "error", "-select_streams", "a:0",
+                 "-show_entries", "stream=codec_name", "-of", "default=nw=1:nk=1", src.name],
+                capture_output=True,
+            )
+            if probe.returncode != 0 or not probe.stdout.strip():
+                raise ValueError("Failed to decode audio: no audio stream found")
+            decoded = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", src.name,
+                 "-ar", "16000", "-ac", "1", "-f", "wav", dst.name],
+                capture_output=True,
+            )
+            if decoded.returncode != 0:
+                raise ValueError(f"Failed to decode audio: {decoded.stderr.decode(errors='replace').strip()}")
+            return Path(dst.name).read_bytes()
 
     # ---- API endpoints ----
 
@@ -386,7 +434,7 @@ def web():
     async def synthesize(req: TTSRequest):
         """Synthesize speech with a selected voice."""
         text = req.input or req.text
-        if not text or not text.strip():
+        if not text or text.isspace():
             raise HTTPException(400, "text is required")
         if len(text) > 4096:
             raise HTTPException(400, "text must be under 4096 characters")
@@ -396,19 +444,25 @@ def web():
         if req.voice and req.voice_id == "ja_female_warm":
             voice_id = req.voice
 
+        opus = req.format == "opus"
         try:
             audio_bytes = _synthesize_with_model(
                 text=text,
                 voice_id=voice_id,
                 speed=req.speed,
+                codec="opus" if opus else "mp3",
             )
 
-            content_type = "audio/mpeg" if req.format == "mp3" else "audio/wav"
+            if opus:
+                content_type, ext = "audio/ogg", "ogg"
+            else:
+                content_type = "audio/mpeg" if req.format == "mp3" else "audio/wav"
+                ext = req.format
             return Response(
                 content=audio_bytes,
                 media_type=content_type,
                 headers={
-                    "Content-Disposition": f'inline; filename="speech.{req.format}"',
+                    "Content-Disposition": f'inline; filename="speech.{ext}"',
                 },
             )
         except Exception as e:
@@ -495,7 +549,6 @@ def web():
         if not voice_dir.exists():
             raise HTTPException(404, "Voice not found")
 
-        import shutil
         shutil.rmtree(str(voice_dir))
         voice_volume.commit()
 
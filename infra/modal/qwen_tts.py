@@ -7,14 +7,27 @@ Logs:    modal app logs qwen-tts
 
 Exposes:
   POST /synthesize  — JSON body: { text, voice?, reference_audio?, language?, speed? }
-                      Returns: audio/mpeg bytes (MP3)
-  GET  /health      — Returns model status
+                      Returns: MP3, or WAV/FLAC when the Accept header asks for it
+  GET  /health      — Returns service status
   GET  /voices      — Lists available preset voices
 """
 import io
+import math
 import base64
 import modal
 
+try:  # Ships with torch inside the image; absent on machines that only deploy
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+try:  # Kernel globals for linear_resample; numba always brings numpy
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
 # ---------------------------------------------------------------------------
 # Modal image: Qwen3-TTS with voice cloning support
 # ---------------------------------------------------------------------------
@@ -27,7 +40,9 @@ qwen_image = (
         "transformers>=4.40.0",
         "soundfile",
         "numpy",
-        "pydub",
+        "numba",
+        "lameenc",
+        "optimum-quanto",
         "fastapi[standard]",
     )
     # Pre-download Qwen3-TTS model during image build
@@ -41,129 +56,507 @@ qwen_image = (
     )
 )
 
+# ONNX Runtime variant of the talker for the T4 deployment. The export can
+# fail for remote-code architectures; QwenTTSLite then serves with PyTorch.
+QWEN_ONNX_DIR = "/models/qwen-onnx"
+qwen_lite_image = (
+    qwen_image
+    .pip_install("optimum[onnxruntime-gpu]")
+    .run_commands(
+        "optimum-cli export onnx --model Qwen/Qwen-Audio-Chat --trust-remote-code "
+        f"--task text-generation-with-past {QWEN_ONNX_DIR} "
+        "|| echo 'ONNX export failed, QwenTTSLite will use PyTorch'"
+    )
+)
+
 app = modal.App("qwen-tts", image=qwen_image)
 
+# Generation length; also the size of the static KV cache
+MAX_LENGTH = 2048
+
+# Concurrent synthesize calls Modal pools into one batch, and how long it waits
+MAX_BATCH_SIZE = 4
+BATCH_WAIT_MS = 50
+
+# Set to 4 (or 2) to store the KV cache quantized, which fits larger decode
+# batches in VRAM. Replaces the CUDA-graph decode; check output quality
+# before enabling.
+KV_CACHE_BITS = None
+
+# Route preset voices to QwenTTSLite (T4). Off until the ONNX export yields
+# audio; until then the T4 runs the PyTorch talker, slower than QwenTTS.
+PRESETS_ON_LITE = False
+
+# Lossless responses libsndfile writes directly; anything else is MP3
+SOUNDFILE_FORMATS = {"audio/flac": "FLAC", "audio/wav": "WAV"}
+
+
+def negotiate_media_type(accept: str) -> str:
+    """FLAC or WAV when the Accept header lists it, else MP3."""
+    if "audio/flac" in accept:
+        return "audio/flac"
+    if "audio/wav" in accept or "audio/x-wav" in accept:
+        return "audio/wav"
+    return "audio/mpeg"
+
 # ---------------------------------------------------------------------------
-# Model container — GPU instance with Qwen3-TTS loaded
+# Fused Triton kernels for the talker's RMSNorm and SwiGLU gating — one HBM
+# read and one write per element instead of a round-trip per elementwise op
 # ---------------------------------------------------------------------------
-@app.cls(
-    gpu="A10G",  # 24GB VRAM, good for voice cloning
-    container_idle_timeout=300,
-    timeout=600,
-)
-class QwenTTS:
-    @modal.enter()
-    def load_model(self):
-        """Load Qwen3-TTS model on container startup."""
+if triton is not None:
+    @triton.jit
+    def _rms_norm_kernel(x_ptr, w_ptr, out_ptr, stride, n_cols, eps, BLOCK: tl.constexpr):
+        row = tl.program_id(0)
+        cols = tl.arange(0, BLOCK)
+        mask = cols < n_cols
+        x = tl.load(x_ptr + row * stride + cols, mask=mask, other=0.0).to(tl.float32)
+        w = tl.load(w_ptr + cols, mask=mask, other=0.0).to(tl.float32)
+        var = tl.sum(x * x, axis=0) / n_cols
+        y = x * tl.rsqrt(var + eps) * w
+        tl.store(out_ptr + row * stride + cols, y.to(out_ptr.dtype.element_ty), mask=mask)
+
+    @triton.jit
+    def _silu_mul_kernel(gate_ptr, up_ptr, out_ptr, n, BLOCK: tl.constexpr):
+        offs = tl.program_id(0) * BLOCK + tl.arange(0, BLOCK)
+        mask = offs < n
+        g = tl.load(gate_ptr + offs, mask=mask).to(tl.float32)
+        u = tl.load(up_ptr + offs, mask=mask).to(tl.float32)
+        y = g * tl.sigmoid(g) * u
+        tl.store(out_ptr + offs, y.to(out_ptr.dtype.element_ty), mask=mask)
+
+
+# ---------------------------------------------------------------------------
+# Speed change: float32 linear resample, parallel over output samples
+# ---------------------------------------------------------------------------
+if numba is not None:
+    @numba.njit(fastmath=True, parallel=True, cache=True)
+    def linear_resample(x, ratio):
+        """Sample x at 0, ratio, 2*ratio, ... (np.interp over np.arange(0, len, ratio))."""
+        n = len(x)
+        out = np.empty(int(math.ceil(n / ratio)), dtype=np.float32)
+        for k in numba.prange(len(out)):
+            t = k * ratio
+            i = int(t)
+            if i >= n - 1:
+                out[k] = x[n - 1]
+            else:
+                frac = t - i
+                out[k] = x[i] * (1.0 - frac) + x[i + 1] * frac
+        return out
+
+    def _specialized_resample(ratio):
+        """linear_resample with the ratio frozen in as a compile-time constant."""
+        ratio = np.float32(ratio)
+
+        @numba.njit(fastmath=True, parallel=True)
+        def kernel(x):
+            n = len(x)
+            out = np.empty(int(math.ceil(n / ratio)), dtype=np.float32)
+            for k in numba.prange(len(out)):
+                t = k * ratio
+                i = int(t)
+                if i >= n - 1:
+                    out[k] = x[n - 1]
+                else:
+                    frac = t - i
+                    out[k] = x[i] * (1.0 - frac) + x[i + 1] * frac
+            return out
+
+        return kernel
+
+# Speeds clients actually pick get their own kernel, compiled during warm-up
+COMMON_SPEEDS = (0.75, 1.25, 1.5)
+_speed_kernels = {}
+
+
+def speed_resample(x, speed: float):
+    """Resample x by speed, dispatching to a per-ratio kernel when one exists."""
+    kernel = _speed_kernels.get(speed)
+    if kernel is None and speed in COMMON_SPEEDS:
+        kernel = _speed_kernels[speed] = _specialized_resample(speed)
+    if kernel is not None:
+        return kernel(x)
+    return linear_resample(x, np.float32(speed))
+
+
+def triton_rms_norm(x, weight, eps: float):
+    """x * rsqrt(mean(x^2) + eps) * weight over the last dim, one pass per row."""
+    n = x.shape[-1]
+    rows = x.reshape(-1, n).contiguous()
+    out = rows.new_empty(rows.shape)
+    _rms_norm_kernel[(rows.shape[0],)](
+        rows, weight, out, rows.stride(0), n, eps, BLOCK=triton.next_power_of_2(n)
+    )
+    return out.view(x.shape)
+
+
+def triton_silu_mul(gate, up):
+    """silu(gate) * up in a single elementwise pass."""
+    gate, up = gate.contiguous(), up.contiguous()
+    out = gate.new_empty(gate.shape)
+    n = gate.numel()
+    _silu_mul_kernel[(triton.cdiv(n, 1024),)](gate, up, out, n, BLOCK=1024)
+    return out
+
+# ---------------------------------------------------------------------------
+# Model containers — shared talker logic, deployed on two GPU sizes below
+# ---------------------------------------------------------------------------
+class QwenTalker:
+    """Qwen3-TTS load/warm-up/synthesis; subclassed per Modal deployment."""
+
+    # torch dtype name for weights and autocast
+    compute_dtype = "bfloat16"
+
+    @modal.enter(snap=True)
+    def load_weights(self):
+        """Load Qwen3-TTS weights into host memory; captured in the snapshot.
+
+        No GPU is attached while the snapshot is taken, so the weights stay
+        on the CPU here and are moved over in warm().
+        """
         import torch
         from transformers import AutoModel, AutoProcessor
 
         print("Loading Qwen3-TTS model...")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = AutoModel.from_pretrained(
-            "Qwen/Qwen-Audio-Chat",
-            trust_remote_code=True,
-        ).to(self.device)
+        # Half precision halves weight traffic on the GPU
+        dtype = getattr(torch, self.compute_dtype)
+        try:
+            model = AutoModel.from_pretrained(
+                "Qwen/Qwen-Audio-Chat",
+                trust_remote_code=True,
+                torch_dtype=dtype,
+                attn_implementation="sdpa",
+            )
+        except (ValueError, TypeError) as e:
+            # Remote-code models may not accept attn_implementation
+            print(f"SDPA attention unavailable ({e}), loading default attention")
+            model = AutoModel.from_pretrained(
+                "Qwen/Qwen-Audio-Chat",
+                trust_remote_code=True,
+                torch_dtype=dtype,
+            )
+        self.model = model
         self.processor = AutoProcessor.from_pretrained(
             "Qwen/Qwen-Audio-Chat",
             trust_remote_code=True,
         )
+        # Decoder-only batches must be left-padded so generated tokens line up
+        tokenizer = getattr(self.processor, "tokenizer", self.processor)
+        tokenizer.padding_side = "left"
+
+    @modal.enter(snap=False)
+    def warm(self):
+        """Move the restored weights to the GPU and warm up before serving."""
+        import torch
+
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # CPU stays fp32
+        if self.device == "cuda":
+            self.model = self.model.to(self.device)
+        else:
+            self.model = self.model.float()
         print(f"Qwen3-TTS loaded on {self.device}")
+        if self.device == "cuda":
+            self._apply_triton_kernels()
+            # Eager passes first so cuBLAS/allocator setup is out of the way
+            warm_inputs = self.processor(text=["warm up"], return_tensors="pt").to(self.device)
+            for _ in range(2):
+                self._generate(warm_inputs, max_new_tokens=8)
+            if KV_CACHE_BITS:
+                self._enable_quantized_kv_cache(KV_CACHE_BITS)
+            else:
+                self._enable_graph_decode()
+        self._warm_speed_kernels()
+
+    def _warm_speed_kernels(self):
+        """JIT the common speed kernels now rather than on a user's request."""
+        if numba is not None:
+            for speed in COMMON_SPEEDS:
+                speed_resample(np.zeros(16, dtype=np.float32), speed)
+
+    def _generate(self, inputs, **kwargs):
+        import torch
+        if "max_new_tokens" not in kwargs:
+            kwargs["max_length"] = MAX_LENGTH
+        with torch.inference_mode(), torch.autocast(
+            "cuda", dtype=getattr(torch, self.compute_dtype), enabled=self.device == "cuda"
+        ):
+            return self.model.generate(**inputs, **kwargs)
+
+    def _apply_triton_kernels(self):
+        """Swap the talker's RMSNorm and SwiGLU forwards for the fused kernels.
+
+        Each layer type is checked against its original forward on random input
+        first and left alone if the results disagree.
+        """
+        import torch
+
+        if triton is None:
+            print("Triton unavailable, keeping stock RMSNorm/MLP")
+            return
+
+        def fused_norm(m):
+            eps = getattr(m, "eps", getattr(m, "variance_epsilon", 1e-6))
+            return lambda x: triton_rms_norm(x, m.weight, eps)
+
+        def fused_mlp(m):
+            if hasattr(m, "gate_proj"):  # Qwen2: down(silu(gate(x)) * up(x))
+                return lambda x: m.down_proj(triton_silu_mul(m.gate_proj(x), m.up_proj(x)))
+            # QWen: c_proj(w1(x) * silu(w2(x)))
+            return lambda x: m.c_proj(triton_silu_mul(m.w2(x), m.w1(x)))
+
+        def matches(m, fused, width):
+            dtype = next(m.parameters()).dtype
+            x = torch.randn(4, width, device=self.device, dtype=dtype)
+            with torch.no_grad():
+                ref, out = m(x), fused(x)
+            tol = 1e-3 if dtype == torch.float32 else 1e-2
+            return ((ref - out).abs().max() / ref.abs().max().clamp(min=1e-6)).item() <= tol
+
+        verdicts: dict = {}
+        patched = 0
+        for m in self.model.modules():
+            kind = type(m).__name__
+            if kind.endswith("RMSNorm") and getattr(m, "weight", None) is not None:
+                fused, width = fused_norm(m), m.weight.shape[-1]
+            elif all(hasattr(m, a) for a in ("gate_proj", "up_proj", "down_proj")):
+                fused, width = fused_mlp(m), m.gate_proj.in_features
+            elif all(hasattr(m, a) for a in ("w1", "w2", "c_proj")):
+                fused, width = fused_mlp(m), m.w1.in_features
+            else:
+                continue
+            if kind not in verdicts:
+                try:
+                    verdicts[kind] = matches(m, fused, width)
+                except Exception as e:
+                    print(f"Triton {kind} check failed: {e}")
+                    verdicts[kind] = False
+            if verdicts[kind]:
+                m.forward = fused
+                patched += 1
+        print(f"Triton kernels: {patched} modules patched, verdicts {verdicts}")
+
+    def _enable_graph_decode(self):
+        """Decode with a static KV cache and a CUDA-graph-captured forward.
+
+        A static cache keeps every decode step's shapes fixed, so torch.compile's
+        reduce-overhead mode records the step once and replays it per token
+        instead of relaunching each kernel through Python. Falls back to the
+        dynamic cache and eager forward if the model rejects either.
+        """
+        import torch
+
+        eager_forward = self.model.forward
+        self.model.generation_config.cache_implementation = "static"
+        self.model.forward = torch.compile(eager_forward, mode="reduce-overhead", fullgraph=False)
+        try:
+            # Warm-up generate triggers compilation and graph capture
+            self._generate(self.processor(text=["warm up"], return_tensors="pt").to(self.device))
+            print("CUDA-graph decode enabled (static KV cache)")
+        except Exception as e:
+            print(f"CUDA-graph decode unavailable, using eager: {e}")
+            self.model.forward = eager_forward
+            self.model.generation_config.cache_implementation = None
 
-    @modal.method()
+    def _enable_quantized_kv_cache(self, bits: int):
+        """Keep past keys/values as per-group quantized integers (quanto backend).
+
+        Calibration-free: scales are computed from each block as it is written,
+        and only the most recent tokens stay in full precision. Falls back to
+        the CUDA-graph decode if the model's cache path rejects it.
+        """
+        config = self.model.generation_config
+        config.cache_implementation = "quantized"
+        config.cache_config = {"backend": "quanto", "nbits": bits}
+        try:
+            self._generate(
+                self.processor(text=["warm up"], return_tensors="pt").to(self.device),
+                max_new_tokens=8,
+            )
+            print(f"Quantized KV cache enabled ({bits}-bit)")
+        except Exception as e:
+            print(f"Quantized KV cache unavailable, using CUDA-graph decode: {e}")
+            config.cache_implementation = None
+            config.cache_config = None
+            self._enable_graph_decode()
+
+    @modal.batched(max_batch_size=MAX_BATCH_SIZE, wait_ms=BATCH_WAIT_MS)
     def synthesize(
         self,
-        text: str,
-        voice: str = "default",
-        reference_audio: str | None = None,
-        language: str = "ja",
-        speed: float = 1.0,
-    ) -> bytes:
+        text: list[str],
+        voice: list[str],
+        reference_audio: list[str | None],
+        language: list[str],
+        speed: list[float],
+        media_type: list[str],
+    ) -> list[bytes]:
         """
         Synthesize speech from text with optional voice cloning.
 
+        Modal pools concurrent calls into lists; callers pass single values.
+        Preset-voice requests share one padded generate, cloning requests run
+        individually since each carries its own reference audio.
+
         Args:
             text: Text to synthesize
             voice: Voice preset (or "clone" for reference-based cloning)
             reference_audio: Base64-encoded audio for voice cloning
             language: Language code (ja, en, zh)
             speed: Speech speed multiplier
+            media_type: Output encoding, from negotiate_media_type
 
         Returns:
-            MP3 audio bytes
+            Encoded audio bytes, one per request
         """
-        import torch
         import soundfile as sf
-        from pydub import AudioSegment
 
         try:
-            # Voice cloning mode
-            if reference_audio and voice == "clone":
-                # Decode reference audio
-                ref_audio_bytes = base64.b64decode(reference_audio)
-
-                # Load reference audio
-                import io
-                ref_audio, ref_sr = sf.read(io.BytesIO(ref_audio_bytes))
-
-                # Generate with voice cloning
-                prompt = f"<|audio_start|><|audio_end|>{text}"
+            results: list = [None] * len(text)
+            preset = []
+            for i, (t, v, ref) in enumerate(zip(text, voice, reference_audio)):
+                # Voice cloning mode
+                if ref and v == "clone":
+                    ref_audio, ref_sr = sf.read(io.BytesIO(base64.b64decode(ref)))
+                    inputs = self.processor(
+                        text=[f"<|audio_start|><|audio_end|>{t}"],
+                        audios=[ref_audio],
+                        sampling_rate=ref_sr,
+                        return_tensors="pt",
+                    ).to(self.device)
+                    outputs = self._generate(inputs)
+                    results[i] = self._encode_audio(
+                        outputs.audio[0].float().cpu().numpy(), outputs.sampling_rate,
+                        speed[i], media_type[i],
+                    )
+                # Preset voice mode (simplified for now)
+                else:
+                    preset.append(i)
+
+            if preset:
                 inputs = self.processor(
-                    text=[prompt],
-                    audios=[ref_audio],
-                    sampling_rate=ref_sr,
+                    text=[text[i] for i in preset],
+                    padding=True,
                     return_tensors="pt",
                 ).to(self.device)
+                outputs = self._generate(inputs)
+                for row, i in enumerate(preset):
+                    sample_rate = 24000  # Default Qwen sample rate
+                    results[i] = self._encode_audio(
+                        outputs.audio[row].float().cpu().numpy(), sample_rate,
+                        speed[i], media_type[i],
+                    )
 
-                with torch.no_grad():
-                    outputs = self.model.generate(**inputs, max_length=2048)
-                    audio_output = outputs.audio[0].cpu().numpy()
-                    sample_rate = outputs.sampling_rate
+            return results
 
-            # Preset voice mode
-            else:
-                # Use preset voices (simplified for now)
-                inputs = self.processor(
-                    text=[text],
-                    return_tensors="pt",
-                ).to(self.device)
+        except Exception as e:
+            print(f"Qwen TTS error: {e}")
+            raise
 
-                with torch.no_grad():
-                    outputs = self.model.generate(**inputs, max_length=2048)
-                    audio_output = outputs.audio[0].cpu().numpy()
-                    sample_rate = 24000  # Default Qwen sample rate
+    def _encode_audio(self, audio_output, sample_rate: int, speed: float, media_type: str) -> bytes:
+        """Apply the speed change and encode in-process (libsndfile or LAME)."""
+        import lameenc
+        import numpy as np
+        import soundfile as sf
 
-            # Apply speed adjustment
-            if speed != 1.0:
-                import numpy as np
-                indices = np.arange(0, len(audio_output), speed)
+        # Apply speed adjustment
+        if speed != 1.0:
+            audio_output = np.ascontiguousarray(audio_output, dtype=np.float32)
+            if numba is not None:
+                audio_output = speed_resample(audio_output, speed)
+            else:
+                indices = np.arange(0, len(audio_output), speed, dtype=np.float32)
                 audio_output = np.interp(indices, np.arange(len(audio_output)), audio_output)
 
-            # Convert to MP3
-            wav_buffer = io.BytesIO()
-            sf.write(wav_buffer, audio_output, sample_rate, format="WAV")
-            wav_buffer.seek(0)
+        # WAV/FLAC-capable clients skip the MP3 encode entirely
+        if media_type in SOUNDFILE_FORMATS:
+            buf = io.BytesIO()
+            sf.write(buf, audio_output, int(sample_rate),
+                     format=SOUNDFILE_FORMATS[media_type], subtype="PCM_16")
+            return buf.getvalue()
 
-            audio_segment = AudioSegment.from_wav(wav_buffer)
-            mp3_buffer = io.BytesIO()
-            audio_segment.export(mp3_buffer, format="mp3", bitrate="128k")
+        # Convert to MP3. A fresh encoder per call: flush() finalizes the stream
+        # and the clone path's sample rate varies per request.
+        pcm16 = (np.clip(audio_output, -1.0, 1.0) * 32767).astype(np.int16)
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(128)
+        encoder.set_in_sample_rate(int(sample_rate))
+        encoder.set_channels(1)
+        encoder.set_quality(5)
+        return bytes(encoder.encode(pcm16.tobytes()) + encoder.flush())
 
-            return mp3_buffer.getvalue()
 
-        except Exception as e:
-            print(f"Qwen TTS error: {e}")
-            raise
+@app.cls(
+    gpu="A10G",  # 24GB VRAM, good for voice cloning
+    container_idle_timeout=300,
+    timeout=600,
+    enable_memory_snapshot=True,
+)
+class QwenTTS(QwenTalker):
+    """Full PyTorch talker; serves voice cloning."""
 
-    @modal.method()
-    def health(self) -> dict:
-        """Health check endpoint."""
-        import torch
-        return {
-            "status": "ok",
-            "model": "Qwen3-TTS",
-            "device": self.device,
-            "gpu_available": torch.cuda.is_available(),
-        }
+
+@app.cls(
+    gpu="T4",  # Cheaper card for preset voices
+    image=qwen_lite_image,
+    container_idle_timeout=300,
+    timeout=600,
+    enable_memory_snapshot=True,
+)
+class QwenTTSLite(QwenTalker):
+    """Preset voices on the ONNX Runtime export, PyTorch fp16 if the export failed."""
+
+    # T4 has no native bf16
+    compute_dtype = "float16"
+
+    @modal.enter(snap=True)
+    def load_weights(self):
+        import os
+
+        # The build step's `|| echo` can leave a partial export directory behind
+        if not os.path.isfile(os.path.join(QWEN_ONNX_DIR, "model.onnx")):
+            print("No ONNX export found, loading the PyTorch talker")
+            self.use_onnx = False
+            return super().load_weights()
+
+        from transformers import AutoProcessor
+
+        # The CUDA session is created in warm(): no GPU during the snapshot
+        self.use_onnx = True
+        self.processor = AutoProcessor.from_pretrained(
+            "Qwen/Qwen-Audio-Chat",
+            trust_remote_code=True,
+        )
+        tokenizer = getattr(self.processor, "tokenizer", self.processor)
+        tokenizer.padding_side = "left"
+
+    @modal.enter(snap=False)
+    def warm(self):
+        if not self.use_onnx:
+            return super().warm()
+        from optimum.onnxruntime import ORTModelForCausalLM
+
+        # ORT fuses the graph at session creation; one pass allocates its arena
+        self.device = "cuda"
+        warm_inputs = self.processor(text=["warm up"], return_tensors="pt").to(self.device)
+        try:
+            print("Loading Qwen3-TTS ONNX export...")
+            self.model = ORTModelForCausalLM.from_pretrained(
+                QWEN_ONNX_DIR,
+                provider="CUDAExecutionProvider",
+                trust_remote_code=True,
+            )
+            outputs = self._generate(warm_inputs, max_new_tokens=8)
+        except Exception as e:
+            print(f"ONNX Runtime warm-up failed ({e})")
+            outputs = None
+        # A text-generation export returns token ids; synthesize needs .audio
+        if not hasattr(outputs, "audio"):
+            print("ONNX export does not produce audio, loading the PyTorch talker")
+            self.use_onnx = False
+            super().load_weights()
+            return super().warm()
+        self._warm_speed_kernels()
+        print("Qwen3-TTS ONNX Runtime session ready")
 
 # ---------------------------------------------------------------------------
 # FastAPI web endpoint
@@ -172,14 +565,18 @@ class QwenTTS:
     image=qwen_image,
     keep_warm=1,  # Keep 1 container warm for low latency
 )
+# Lets concurrent requests reach QwenTTS together so they can be batched
+@modal.concurrent(max_inputs=16)
 @modal.asgi_app()
 def api():
-    from fastapi import FastAPI, HTTPException
+    import asyncio
+    from fastapi import FastAPI, HTTPException, Request
     from fastapi.responses import Response
     from pydantic import BaseModel
 
     web_app = FastAPI(title="Qwen3 TTS API")
     qwen = QwenTTS()
+    qwen_lite = QwenTTSLite()
 
     class SynthesizeRequest(BaseModel):
         text: str
@@ -188,25 +585,49 @@ def api():
         language: str = "ja"
         speed: float = 1.0
 
+    def check_reference_audio(reference_audio: str):
+        """Decode the clone reference here so bad input never reaches a batch."""
+        import soundfile as sf
+
+        ref_audio, _ = sf.read(io.BytesIO(base64.b64decode(reference_audio)))
+        if len(ref_audio) == 0:
+            raise ValueError("reference_audio is empty")
+
     @web_app.post("/synthesize")
-    async def synthesize(req: SynthesizeRequest):
+    async def synthesize(req: SynthesizeRequest, request: Request):
         """Synthesize speech from text."""
+        cloning = req.voice == "clone" and req.reference_audio
+        if cloning:
+            # QwenTTS.synthesize is batched: one caller's malformed reference
+            # would otherwise fail every request pooled with it
+            try:
+                await asyncio.to_thread(check_reference_audio, req.reference_audio)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid reference_audio: {e}")
+        # Preset voices go to the T4 deployment only when opted in
+        target = qwen_lite if PRESETS_ON_LITE and not cloning else qwen
+        media_type = negotiate_media_type(request.headers.get("accept", ""))
         try:
-            audio_bytes = qwen.synthesize.remote(
+            audio_bytes = await target.synthesize.remote.aio(
                 text=req.text,
                 voice=req.voice,
                 reference_audio=req.reference_audio,
                 language=req.language,
                 speed=req.speed,
+                media_type=media_type,
             )
-            return Response(content=audio_bytes, media_type="audio/mpeg")
+            return Response(content=audio_bytes, media_type=media_type)
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
     @web_app.get("/health")
     async def health():
-        """Health check."""
-        return qwen.health.remote()
+        """Health check.
+
+        Answered by the web container: a class with a batched method can't
+        expose other Modal methods, so the GPU containers aren't queried.
+        """
+        return {"status": "ok", "model": "Qwen3-TTS"}
 
     @web_app.get("/voices")
     async def voices():
@@ -231,14 +652,14 @@ def test():
     print("Testing Japanese synthesis...")
     audio = qwen.synthesize.remote(
         text="こんにちは、ゆうきです。chatweb.aiへようこそ！",
+        voice="default",
+        reference_audio=None,
         language="ja",
+        speed=1.0,
+        media_type="audio/mpeg",
     )
 
     # Save test output
     with open("/tmp/qwen_test.mp3", "wb") as f:
         f.write(audio)
     print(f"✓ Test audio saved: /tmp/qwen_test.mp3 ({len(audio)} bytes)")
-
-    # Health check
-    status = qwen.health.remote()
-    print(f"✓ Health: {status}")
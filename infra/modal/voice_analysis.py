@@ -12,6 +12,8 @@ Exposes:
   GET  /health    — Health check
 """
 import io
+from concurrent.futures import ThreadPoolExecutor
+
 import modal
 
 # ---------------------------------------------------------------------------
@@ -36,6 +38,10 @@ analysis_image = (
 
 app = modal.App("voice-analysis", image=analysis_image)
 
+# Worker threads for the independent numpy/librosa metrics; these release
+# the GIL inside their C/FFT code and overlap with the Praat analysis.
+_POOL = ThreadPoolExecutor(max_workers=4)
+
 
 # ---------------------------------------------------------------------------
 # Voice type classification based on pitch
@@ -97,20 +103,16 @@ def compute_snr(audio, sr: int) -> float:
 
     # Simple energy-based SNR estimation
     # Split into frames, classify as speech or silence based on energy
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
     frame_length = int(0.025 * sr)  # 25ms frames
     hop_length = int(0.010 * sr)    # 10ms hop
 
-    # Compute frame energies
-    frames = []
-    for i in range(0, len(audio) - frame_length, hop_length):
-        frame = audio[i:i + frame_length]
-        energy = np.sum(frame ** 2) / frame_length
-        frames.append(energy)
-
-    if not frames:
+    if len(audio) <= frame_length:
         return 0.0
 
-    frames = np.array(frames)
+    # Compute frame energies (strided view, one reduction over all frames)
+    windows = np.lib.stride_tricks.sliding_window_view(audio, frame_length)[::hop_length]
+    frames = np.einsum("ij,ij->i", windows, windows) / frame_length
     # Use energy threshold to separate speech from noise
     threshold = np.percentile(frames[frames > 0], 15) if np.any(frames > 0) else 0
     speech_energy = np.mean(frames[frames > threshold]) if np.any(frames > threshold) else 1e-10
@@ -123,133 +125,128 @@ def compute_snr(audio, sr: int) -> float:
     return float(np.clip(snr, 0, 60))
 
 
-def compute_spectral_flatness_mean(audio, sr: int) -> float:
-    """Compute mean spectral flatness (0=tonal, 1=noisy)."""
+def compute_magnitude_spectrogram(audio):
+    """Compute the |STFT| shared by the spectral feature helpers."""
     import librosa
     import numpy as np
 
-    flatness = librosa.feature.spectral_flatness(y=audio, n_fft=2048, hop_length=512)
-    return float(np.mean(flatness))
+    return np.abs(librosa.stft(audio, n_fft=2048, hop_length=512))
 
 
-def compute_spectral_centroid_mean(audio, sr: int) -> float:
-    """Compute mean spectral centroid in Hz."""
+def compute_spectral_flatness_mean(S) -> float:
+    """Compute mean spectral flatness (0=tonal, 1=noisy) from a magnitude spectrogram."""
     import librosa
     import numpy as np
 
-    centroid = librosa.feature.spectral_centroid(y=audio, sr=sr, n_fft=2048, hop_length=512)
-    return float(np.mean(centroid))
+    flatness = librosa.feature.spectral_flatness(S=S)
+    return float(np.mean(flatness))
 
 
-def compute_harmonic_ratio(audio, sr: int) -> float:
-    """Compute harmonic-to-noise ratio using librosa's harmonic/percussive separation."""
+def compute_spectral_centroid_mean(S, sr: int) -> float:
+    """Compute mean spectral centroid in Hz from a magnitude spectrogram."""
     import librosa
     import numpy as np
 
-    harmonic, percussive = librosa.effects.hpss(audio)
-    h_energy = np.sum(harmonic ** 2)
-    p_energy = np.sum(percussive ** 2)
-
-    if p_energy <= 0:
-        return 30.0  # Very harmonic
-
-    hnr = 10 * np.log10(h_energy / p_energy)
-    return float(np.clip(hnr, 0, 40))
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=2048)
+    return float(np.mean(centroid))
 
 
 def compute_dynamic_range(audio, sr: int) -> float:
     """Compute dynamic range in dB (difference between loud and quiet parts)."""
     import numpy as np
 
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
     frame_length = int(0.025 * sr)
     hop_length = int(0.010 * sr)
 
-    energies = []
-    for i in range(0, len(audio) - frame_length, hop_length):
-        frame = audio[i:i + frame_length]
-        rms = np.sqrt(np.mean(frame ** 2))
-        if rms > 0:
-            energies.append(20 * np.log10(rms))
+    if len(audio) <= frame_length:
+        return 0.0
+
+    windows = np.lib.stride_tricks.sliding_window_view(audio, frame_length)[::hop_length]
+    rms = np.sqrt(np.einsum("ij,ij->i", windows, windows) / frame_length)
+    rms = rms[rms > 0]
 
-    if not energies:
+    if rms.size == 0:
         return 0.0
 
-    energies = np.array(energies)
+    energies = 20 * np.log10(rms)
     # Use percentiles to avoid outliers
     loud = np.percentile(energies, 95)
     quiet = np.percentile(energies, 5)
     return float(loud - quiet)
 
 
-def analyze_with_parselmouth(audio_bytes: bytes) -> dict:
+def analyze_with_parselmouth(audio, sr: int) -> dict:
     """Run Praat-based analysis using parselmouth."""
     import parselmouth
     import numpy as np
-    import tempfile
-    import os
 
-    # Write to temp file for parselmouth
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-        f.write(audio_bytes)
-        tmp_path = f.name
+    snd = parselmouth.Sound(values=audio.astype(np.float64), sampling_frequency=sr)
 
-    try:
-        snd = parselmouth.Sound(tmp_path)
-
-        # Pitch analysis
-        pitch = snd.to_pitch(time_step=0.01, pitch_floor=50, pitch_ceiling=600)
-        pitch_values = pitch.selected_array["frequency"]
-        pitch_values = pitch_values[pitch_values > 0]
+    # Pitch analysis
+    pitch = snd.to_pitch(time_step=0.01, pitch_floor=50, pitch_ceiling=600)
+    pitch_values = pitch.selected_array["frequency"]
+    pitch_values = pitch_values[pitch_values > 0]
 
-        pitch_mean = float(np.mean(pitch_values)) if len(pitch_values) > 0 else 0
-        pitch_min = float(np.min(pitch_values)) if len(pitch_values) > 0 else 0
-        pitch_max = float(np.max(pitch_values)) if len(pitch_values) > 0 else 0
-        pitch_std = float(np.std(pitch_values)) if len(pitch_values) > 0 else 0
+    pitch_mean = float(np.mean(pitch_values)) if len(pitch_values) > 0 else 0
+    pitch_min = float(np.min(pitch_values)) if len(pitch_values) > 0 else 0
+    pitch_max = float(np.max(pitch_values)) if len(pitch_values) > 0 else 0
+    pitch_std = float(np.std(pitch_values)) if len(pitch_values) > 0 else 0
 
-        # Jitter and Shimmer
-        point_process = parselmouth.praat.call(snd, "To PointProcess (periodic, cc)", 50, 600)
+    # Jitter and Shimmer
+    point_process = parselmouth.praat.call(snd, "To PointProcess (periodic, cc)", 50, 600)
 
-        jitter = 0.0
-        shimmer = 0.0
-        try:
-            jitter = float(parselmouth.praat.call(
-                point_process, "Get jitter (local)", 0.0, 0.0, 0.0001, 0.02, 1.3
-            ))
-        except Exception:
-            pass
-
-        try:
-            shimmer = float(parselmouth.praat.call(
-                [snd, point_process], "Get shimmer (local)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6
-            ))
-        except Exception:
-            pass
-
-        # Speaking rate estimation (syllable-like events)
-        intensity = snd.to_intensity(minimum_pitch=50)
-        duration = snd.get_total_duration()
-
-        # Estimate syllables from intensity peaks
-        intensity_values = intensity.values[0]
-        threshold = np.mean(intensity_values) - np.std(intensity_values)
-        above = intensity_values > threshold
-        # Count transitions from below to above threshold
-        transitions = np.sum(np.diff(above.astype(int)) > 0)
-        speaking_rate = transitions / duration if duration > 0 else 0
+    jitter = 0.0
+    shimmer = 0.0
+    try:
+        jitter = float(parselmouth.praat.call(
+            point_process, "Get jitter (local)", 0.0, 0.0, 0.0001, 0.02, 1.3
+        ))
+    except Exception:
+        pass
 
-        return {
-            "pitch_mean_hz": round(pitch_mean, 1),
-            "pitch_min_hz": round(pitch_min, 1),
-            "pitch_max_hz": round(pitch_max, 1),
-            "pitch_std_hz": round(pitch_std, 2),
-            "jitter_percent": round(jitter * 100, 2),
-            "shimmer_percent": round(shimmer * 100, 2),
-            "speaking_rate_syl_per_sec": round(speaking_rate, 1),
-            "duration_sec": round(duration, 2),
-        }
+    try:
+        shimmer = float(parselmouth.praat.call(
+            [snd, point_process], "Get shimmer (local)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6
+        ))
+    except Exception:
+        pass
+
+    # Harmonic-to-noise ratio (cross-correlation method, time domain)
+    hnr = 0.0
+    try:
+        harmonicity = parselmouth.praat.call(snd, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
+        hnr = float(parselmouth.praat.call(harmonicity, "Get mean", 0, 0))
+        # Undefined (NaN) when no frame is voiced, e.g. noise or whispering
+        if not np.isfinite(hnr):
+            hnr = 0.0
+        hnr = float(np.clip(hnr, 0, 40))
+    except Exception:
+        pass
+
+    # Speaking rate estimation (syllable-like events)
+    intensity = snd.to_intensity(minimum_pitch=50)
+    duration = snd.get_total_duration()
+
+    # Estimate syllables from intensity peaks
+    intensity_values = intensity.values[0]
+    threshold = np.mean(intensity_values) - np.std(intensity_values)
+    above = intensity_values > threshold
+    # Count transitions from below to above threshold
+    transitions = np.sum(np.diff(above.astype(int)) > 0)
+    speaking_rate = transitions / duration if duration > 0 else 0
 
-    finally:
-        os.unlink(tmp_path)
+    return {
+        "pitch_mean_hz": round(pitch_mean, 1),
+        "pitch_min_hz": round(pitch_min, 1),
+        "pitch_max_hz": round(pitch_max, 1),
+        "pitch_std_hz": round(pitch_std, 2),
+        "jitter_percent": round(jitter * 100, 2),
+        "shimmer_percent": round(shimmer * 100, 2),
+        "harmonic_ratio_db": round(hnr, 1),
+        "speaking_rate_syl_per_sec": round(speaking_rate, 1),
+        "duration_sec": round(duration, 2),
+    }
 
 
 def compute_scores(analysis: dict, snr: float, spectral_flatness: float,
@@ -340,7 +337,6 @@ def web():
     import base64
     import json
     import numpy as np
-    import soundfile as sf
     import librosa
     from fastapi import FastAPI, HTTPException, Response
     from fastapi.middleware.cors import CORSMiddleware
@@ -360,47 +356,56 @@ def web():
         audio_base64: str
         sample_rate: Optional[int] = None
 
+    def _sniff_format(raw: bytes) -> str:
+        """Guess the container format from its magic bytes ("" if unknown)."""
+        if raw[:4] == b"RIFF":
+            return "wav"
+        if raw[:4] == b"OggS":
+            return "ogg"
+        if raw[:4] == b"\x1aE\xdf\xa3":
+            return "webm"
+        if raw[:3] == b"ID3" or (len(raw) > 1 and raw[0] == 0xFF and raw[1] & 0xE0 == 0xE0):
+            return "mp3"
+        if raw[4:8] == b"ftyp":
+            return "m4a"
+        return ""
+
+    def _segment_samples(seg) -> tuple:
+        """Read mono float32 samples straight out of an AudioSegment."""
+        seg = seg.set_channels(1).set_sample_width(2)
+        audio = np.frombuffer(seg.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+        return audio, seg.frame_rate
+
     def _decode_audio(audio_b64: str) -> tuple:
         """Decode base64 audio to numpy array + sample rate."""
         raw = base64.b64decode(audio_b64)
 
-        # Try to load as any audio format
+        # Try the sniffed format first, then probe the rest
+        sniffed = _sniff_format(raw)
+        formats = ["webm", "ogg", "mp3", "wav", "m4a"]
+        if sniffed:
+            formats.remove(sniffed)
+            formats.insert(0, sniffed)
+
         try:
             buf = io.BytesIO(raw)
             from pydub import AudioSegment
-            for fmt in ["webm", "ogg", "mp3", "wav", "m4a"]:
+            for fmt in formats:
                 try:
                     buf.seek(0)
                     seg = AudioSegment.from_file(buf, format=fmt)
-                    # Convert to mono WAV
-                    seg = seg.set_channels(1)
-                    wav_buf = io.BytesIO()
-                    seg.export(wav_buf, format="wav")
-                    wav_buf.seek(0)
-                    audio, sr = sf.read(wav_buf)
-                    return audio.astype(np.float32), sr
+                    return _segment_samples(seg)
                 except Exception:
                     continue
 
             # Last resort: try raw
             buf.seek(0)
             seg = AudioSegment.from_file(buf)
-            seg = seg.set_channels(1)
-            wav_buf = io.BytesIO()
-            seg.export(wav_buf, format="wav")
-            wav_buf.seek(0)
-            audio, sr = sf.read(wav_buf)
-            return audio.astype(np.float32), sr
+            return _segment_samples(seg)
 
         except Exception as e:
             raise ValueError(f"Failed to decode audio: {e}")
 
-    def _get_wav_bytes(audio: np.ndarray, sr: int) -> bytes:
-        """Convert numpy audio to WAV bytes for parselmouth."""
-        wav_buf = io.BytesIO()
-        sf.write(wav_buf, audio, sr, format="WAV")
-        return wav_buf.getvalue()
-
     @fastapi_app.post("/analyze")
     async def analyze(req: AnalyzeRequest):
         """Analyze voice quality from audio sample."""
@@ -412,7 +417,7 @@ def web():
             raise HTTPException(400, "Audio sample too large (max 10MB)")
 
         try:
-            # Decode audio
+            # Decode audio (mono, 16kHz for consistent analysis)
             audio, sr = _decode_audio(req.audio_base64)
 
             # Resample to 16kHz for consistent analysis
@@ -429,21 +434,24 @@ def web():
             if len(audio_trimmed) / sr < 0.3:
                 audio_trimmed = audio  # Use original if trimmed is too short
 
-            # Get WAV bytes for parselmouth
-            wav_bytes = _get_wav_bytes(audio_trimmed, sr)
+            # Run the independent analyses concurrently; Praat dominates, so
+            # it stays on this thread while the rest run on the pool
+            snr_future = _POOL.submit(compute_snr, audio_trimmed, sr)
+            dynamic_range_future = _POOL.submit(compute_dynamic_range, audio_trimmed, sr)
+            spectrogram_future = _POOL.submit(compute_magnitude_spectrogram, audio_trimmed)
+
+            praat_analysis = analyze_with_parselmouth(audio_trimmed, sr)
 
-            # Run analyses in parallel-ish fashion
-            praat_analysis = analyze_with_parselmouth(wav_bytes)
-            snr = compute_snr(audio_trimmed, sr)
-            spectral_flatness = compute_spectral_flatness_mean(audio_trimmed, sr)
-            spectral_centroid = compute_spectral_centroid_mean(audio_trimmed, sr)
-            harmonic_ratio = compute_harmonic_ratio(audio_trimmed, sr)
-            dynamic_range = compute_dynamic_range(audio_trimmed, sr)
+            spectrogram = spectrogram_future.result()
+            spectral_flatness = compute_spectral_flatness_mean(spectrogram)
+            spectral_centroid = compute_spectral_centroid_mean(spectrogram, sr)
+            snr = snr_future.result()
+            dynamic_range = dynamic_range_future.result()
 
             # Compute scores
             scores = compute_scores(
                 praat_analysis, snr, spectral_flatness,
-                spectral_centroid, harmonic_ratio, dynamic_range
+                spectral_centroid, praat_analysis["harmonic_ratio_db"], dynamic_range
             )
 
             # Classify voice type
@@ -467,7 +475,7 @@ def web():
                 "shimmer_percent": praat_analysis["shimmer_percent"],
                 "speaking_rate_syl_per_sec": praat_analysis["speaking_rate_syl_per_sec"],
                 "spectral_centroid_hz": round(spectral_centroid, 0),
-                "harmonic_ratio_db": round(harmonic_ratio, 1),
+                "harmonic_ratio_db": praat_analysis["harmonic_ratio_db"],
                 "dynamic_range_db": round(dynamic_range, 1),
                 "duration_sec": praat_analysis["duration_sec"],
             }
@@ -5,11 +5,17 @@ Provides voice synthesis with custom voice cloning capabilities
 
 import os
 import io
+import re
 import base64
+import asyncio
 import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
 from typing import Optional
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import torch
 from transformers import AutoProcessor, AutoModel
@@ -27,6 +33,45 @@ processor = None
 model = None
 device = None
 
+# Dynamic batching: concurrent requests are pooled for up to MAX_WAIT_MS
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "20"))
+# Cap on padded tokens per generate call (longest input x batch size)
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", "2048"))
+
+# Generation length on GPU; also the size of the static KV cache
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "2048"))
+
+# QUANTIZE=int8 loads linear layers as bitsandbytes LLM.int8 (GPU only)
+QUANTIZE = os.getenv("QUANTIZE", "")
+# Kept in half precision under int8: the output head drives audio quality
+INT8_SKIP_MODULES = ["lm_head"]
+# Representative prompts run through the int8 model before serving
+INT8_WARMUP_PROMPTS = [
+    ("こんにちは、今日はいい天気ですね。", "ja"),
+    ("Hello, thanks for calling. How can I help you today?", "en"),
+    ("你好，欢迎使用语音合成服务。", "zh"),
+    ("音声合成のテストです。Qwen TTS is now ready.", "auto"),
+]
+INT8_WARMUP_COUNT = 32
+
+# Single worker thread that owns every model call, so GPU work stays serialized
+# while the event loop keeps accepting and preprocessing requests
+gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+# Per-thread WAV buffer reused across /synthesize encodes
+_wav_buffers = threading.local()
+
+# Hiragana, katakana and CJK ideographs, for language auto-detection
+_JA_RE = re.compile(r'[\u3040-\u30FF\u4E00-\u9FFF]')
+
+# /synthesize/stream writes the finished clip out 20 ms of PCM at a time
+STREAM_CHUNK_MS = 20
+
+# (text, language, future) entries waiting for the batch worker
+request_queue: Optional[asyncio.Queue] = None
+batch_worker_task: Optional[asyncio.Task] = None
+
 class SynthesizeRequest(BaseModel):
     text: str
     voice: Optional[str] = "default"
@@ -56,10 +101,37 @@ async def load_model():
 
         logger.info(f"Loading model: {model_name}")
         processor = AutoProcessor.from_pretrained(model_name)
-        model = AutoModel.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-        ).to(device)
+        quantize_int8 = QUANTIZE == "int8" and device == "cuda"
+        if quantize_int8:
+            from transformers import BitsAndBytesConfig
+
+            logger.info("Loading linear layers in int8 (bitsandbytes)")
+            model = AutoModel.from_pretrained(
+                model_name,
+                torch_dtype=torch.bfloat16,
+                device_map="auto",
+                quantization_config=BitsAndBytesConfig(
+                    load_in_8bit=True,
+                    llm_int8_skip_modules=INT8_SKIP_MODULES,
+                ),
+            )
+        else:
+            model = AutoModel.from_pretrained(
+                model_name,
+                torch_dtype=torch.bfloat16 if device == "cuda" else torch.float32,
+            ).to(device)
+        # Left padding keeps batched prompts aligned at the generation start
+        tokenizer = getattr(processor, "tokenizer", processor)
+        tokenizer.padding_side = "left"
+
+        # Warm up on the GPU thread that will serve requests: compiled
+        # CUDA graphs are replayed from the thread that recorded them.
+        # int8 matmuls can't be captured in CUDA graphs.
+        loop = asyncio.get_running_loop()
+        if device == "cuda" and not quantize_int8:
+            await loop.run_in_executor(gpu_executor, enable_compiled_decode)
+        elif quantize_int8:
+            await loop.run_in_executor(gpu_executor, warm_up_int8)
 
         logger.info("Model loaded successfully!")
 
@@ -68,6 +140,192 @@ async def load_model():
         # Fallback to mock mode for development
         logger.warning("Running in MOCK mode - returning synthetic audio")
 
+def enable_compiled_decode():
+    """Decode with a static KV cache and a torch.compile'd forward
+
+    A fixed-size cache keeps every decode step's shapes identical, so
+    reduce-overhead mode captures the step as a CUDA graph and replays it
+    per token. Reverts to the dynamic cache and eager forward on failure.
+    """
+    eager_forward = model.forward
+    model.generation_config.cache_implementation = "static"
+    model.generation_config.max_length = MAX_LENGTH
+    model.forward = torch.compile(eager_forward, mode="reduce-overhead")
+
+    try:
+        # Two passes: the first compiles, the second records the graphs
+        inputs = processor(text="warm up", return_tensors="pt").to(device)
+        for _ in range(2):
+            with torch.no_grad():
+                model.generate(**inputs)
+        logger.info("Compiled decode enabled (static KV cache)")
+    except Exception as e:
+        logger.warning(f"Compiled decode unavailable, using eager: {e}")
+        model.forward = eager_forward
+        model.generation_config.cache_implementation = None
+
+def warm_up_int8():
+    """Run INT8_WARMUP_COUNT representative prompts through the int8 model
+
+    LLM.int8 needs no calibration data, but the first calls per shape pay
+    for kernel selection and outlier-column allocation; take that hit here
+    instead of on the first requests.
+    """
+    try:
+        for i in range(INT8_WARMUP_COUNT):
+            text, language = INT8_WARMUP_PROMPTS[i % len(INT8_WARMUP_PROMPTS)]
+            _generate_batch([text], language)
+        logger.info(f"int8 warm-up done ({INT8_WARMUP_COUNT} prompts)")
+    except Exception as e:
+        logger.warning(f"int8 warm-up failed: {e}")
+
+@app.on_event("startup")
+async def start_batch_worker():
+    """Start the background coroutine that batches generate calls"""
+    global request_queue, batch_worker_task
+
+    request_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
+
+async def _drain(queue: asyncio.Queue, max_items: int, max_wait: float) -> list:
+    """Wait for one entry, then collect more until max_items or max_wait elapses"""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait
+    while len(batch) < max_items:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+def _split_by_length(items: list) -> list:
+    """Sort entries by token length and cut them into sub-batches whose padded
+    size (longest x count) stays under MAX_BATCH_TOKENS"""
+    tokenizer = getattr(processor, "tokenizer", processor)
+    sized = sorted(
+        ((len(tokenizer(item[0])["input_ids"]), item) for item in items),
+        key=lambda pair: pair[0],
+    )
+
+    batches, current = [], []
+    for length, item in sized:
+        # Ascending order: this entry is the longest in the current sub-batch
+        if current and length * (len(current) + 1) > MAX_BATCH_TOKENS:
+            batches.append(current)
+            current = []
+        current.append(item)
+    if current:
+        batches.append(current)
+    return batches
+
+def _trim_padding(audio: np.ndarray) -> np.ndarray:
+    """Drop the zero samples a padded batch leaves after this row's audio ends"""
+    voiced = np.flatnonzero(audio)
+    return audio[:voiced[-1] + 1] if len(voiced) else audio[:0]
+
+def _generate_batch(texts: list, language: str) -> list:
+    """Run one padded generate call and split the audio per input
+
+    Rows come back padded to the longest output in the batch, so each one
+    is cut back to its own length before it is handed to its request.
+    """
+    inputs = processor(
+        text=texts,
+        padding=True,
+        return_tensors="pt",
+        language=language
+    ).to(device)
+
+    with torch.no_grad():
+        outputs = model.generate(**inputs)
+
+    return [_trim_padding(row.squeeze()) for row in outputs.float().cpu().numpy()]
+
+async def batch_worker():
+    """Drain the request queue into batched generate calls, forever"""
+    while True:
+        batch = await _drain(request_queue, MAX_BATCH, MAX_WAIT_MS / 1000)
+
+        # The processor takes one language per call
+        by_language = {}
+        for item in batch:
+            by_language.setdefault(item[1], []).append(item)
+
+        for language, items in by_language.items():
+            try:
+                for sub_batch in _split_by_length(items):
+                    texts = [text for text, _, _ in sub_batch]
+                    # Off the event loop so new requests keep queueing meanwhile
+                    audios = await asyncio.get_running_loop().run_in_executor(
+                        gpu_executor, _generate_batch, texts, language
+                    )
+                    for (_, _, future), audio in zip(sub_batch, audios):
+                        if not future.done():
+                            future.set_result(audio)
+            except Exception as e:
+                logger.error(f"Batched generation failed: {e}")
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+def _run_infer(text: str, language: str, speaker_embedding) -> np.ndarray:
+    """Unbatched generate call for a per-speaker embedding"""
+    inputs = processor(
+        text=text,
+        return_tensors="pt",
+        language=language
+    ).to(device)
+
+    with torch.no_grad():
+        outputs = model.generate(**inputs, speaker_embedding=speaker_embedding)
+
+    return outputs.float().cpu().numpy().squeeze()
+
+def _encode_wav_base64(audio: np.ndarray, sample_rate: int, speed: float) -> tuple:
+    """Apply the speed change and encode as base64 WAV; returns (str, sample count)"""
+    if speed != 1.0:
+        audio = adjust_speed(audio, speed)
+
+    buffer = getattr(_wav_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _wav_buffers.buffer = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    sf.write(buffer, audio, sample_rate, format='WAV')
+
+    # Encode straight from the buffer's memory instead of copying it out
+    with buffer.getbuffer() as view:
+        audio_base64 = base64.b64encode(view).decode('ascii')
+    return audio_base64, len(audio)
+
+def _wav_stream_header(sample_rate: int) -> bytes:
+    """RIFF header for 16-bit mono PCM of unknown length"""
+    unknown = 0xFFFFFFFF
+    return (
+        b"RIFF" + struct.pack("<I", unknown) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data" + struct.pack("<I", unknown)
+    )
+
+def _wav_stream_chunks(audio: np.ndarray, sample_rate: int):
+    """Yield a WAV header, then the clip as PCM16 in STREAM_CHUNK_MS pieces"""
+    chunk_samples = sample_rate * STREAM_CHUNK_MS // 1000
+    pcm = (np.clip(np.asarray(audio, dtype=np.float32).reshape(-1), -1.0, 1.0) * 32767).astype("<i2")
+
+    yield _wav_stream_header(sample_rate)
+    for start in range(0, len(pcm), chunk_samples):
+        yield pcm[start:start + chunk_samples].tobytes()
+
+async def generate_audio(text: str, language: str) -> np.ndarray:
+    """Queue text for the batch worker and wait for its audio"""
+    future = asyncio.get_running_loop().create_future()
+    await request_queue.put((text, language, future))
+    return await future
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -96,10 +354,7 @@ async def synthesize(request: SynthesizeRequest):
         logger.info(f"Synthesizing: {request.text[:50]}...")
 
         # Auto-detect Japanese
-        is_japanese = any('\u3040' <= c <= '\u309F' or
-                         '\u30A0' <= c <= '\u30FF' or
-                         '\u4E00' <= c <= '\u9FFF'
-                         for c in request.text)
+        is_japanese = _is_japanese(request.text)
 
         language = request.language if request.language != "auto" else ("ja" if is_japanese else "en")
 
@@ -109,7 +364,7 @@ async def synthesize(request: SynthesizeRequest):
             try:
                 # Decode base64 audio
                 audio_bytes = base64.b64decode(request.reference_audio)
-                reference_audio, sr = sf.read(io.BytesIO(audio_bytes))
+                reference_audio, sr = await asyncio.to_thread(sf.read, io.BytesIO(audio_bytes))
 
                 # Extract voice embedding (placeholder - implement actual extraction)
                 # reference_embedding = extract_voice_embedding(reference_audio, sr)
@@ -119,36 +374,21 @@ async def synthesize(request: SynthesizeRequest):
                 logger.warning(f"Failed to process reference audio: {e}")
 
         # Generate speech
-        inputs = processor(
-            text=request.text,
-            return_tensors="pt",
-            language=language
-        ).to(device)
-
-        with torch.no_grad():
-            # Add voice embedding if available
-            if reference_embedding is not None:
-                outputs = model.generate(**inputs, speaker_embedding=reference_embedding)
-            else:
-                outputs = model.generate(**inputs)
-
-        # Convert to audio
-        audio_array = outputs.cpu().numpy().squeeze()
-
-        # Apply speed adjustment
-        if request.speed != 1.0:
-            audio_array = adjust_speed(audio_array, request.speed)
-
-        # Convert to bytes
+        if reference_embedding is not None:
+            # Per-speaker embedding, so this request can't share a batch
+            audio_array = await asyncio.get_running_loop().run_in_executor(
+                gpu_executor, _run_infer, request.text, language, reference_embedding
+            )
+        else:
+            audio_array = await generate_audio(request.text, language)
+
+        # Speed change, WAV and base64 encode off the event loop
         sample_rate = 22050  # Adjust based on model
-        buffer = io.BytesIO()
-        sf.write(buffer, audio_array, sample_rate, format='WAV')
-        buffer.seek(0)
-
-        # Encode as base64
-        audio_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+        audio_base64, num_samples = await asyncio.to_thread(
+            _encode_wav_base64, audio_array, sample_rate, request.speed
+        )
 
-        duration = len(audio_array) / sample_rate
+        duration = num_samples / sample_rate
 
         logger.info(f"Synthesis complete: {duration:.2f}s")
 
@@ -171,8 +411,11 @@ async def synthesize_stream(
     reference_audio: Optional[UploadFile] = File(None)
 ):
     """
-    Synthesize speech and return raw audio bytes
-    Optimized for streaming
+    Synthesize speech and send it back as a chunked WAV
+
+    The RIFF header goes out first with an unknown length, followed by
+    the clip in 20 ms PCM chunks. This is chunked transfer only: time to
+    first byte matches /synthesize.
     """
 
     if not model:
@@ -180,10 +423,7 @@ async def synthesize_stream(
 
     try:
         # Auto-detect Japanese
-        is_japanese = any('\u3040' <= c <= '\u309F' or
-                         '\u30A0' <= c <= '\u30FF' or
-                         '\u4E00' <= c <= '\u9FFF'
-                         for c in text)
+        is_japanese = _is_japanese(text)
 
         lang = language if language != "auto" else ("ja" if is_japanese else "en")
 
@@ -192,35 +432,21 @@ async def synthesize_stream(
         if reference_audio:
             try:
                 audio_bytes = await reference_audio.read()
-                reference_audio_data, sr = sf.read(io.BytesIO(audio_bytes))
+                reference_audio_data, sr = await asyncio.to_thread(sf.read, io.BytesIO(audio_bytes))
                 logger.info(f"Loaded reference audio: {len(audio_bytes)} bytes")
             except Exception as e:
                 logger.warning(f"Failed to load reference audio: {e}")
 
-        # Generate speech
-        inputs = processor(
-            text=text,
-            return_tensors="pt",
-            language=lang
-        ).to(device)
-
-        with torch.no_grad():
-            outputs = model.generate(**inputs)
-
-        audio_array = outputs.cpu().numpy().squeeze()
-
-        # Apply speed adjustment
+        # generate() hands back the waveform only once decoding finishes, so
+        # the first byte still waits for the whole clip; the response is just
+        # written out in chunks rather than as one body
+        audio_array = await generate_audio(text, lang)
         if speed != 1.0:
-            audio_array = adjust_speed(audio_array, speed)
+            audio_array = await asyncio.to_thread(adjust_speed, audio_array, speed)
 
-        # Convert to WAV bytes
         sample_rate = 22050
-        buffer = io.BytesIO()
-        sf.write(buffer, audio_array, sample_rate, format='WAV')
-        buffer.seek(0)
-
-        return Response(
-            content=buffer.read(),
+        return StreamingResponse(
+            _wav_stream_chunks(audio_array, sample_rate),
             media_type="audio/wav",
             headers={
                 "Content-Disposition": "attachment; filename=speech.wav"
@@ -248,7 +474,7 @@ async def clone_voice(
     try:
         # Read uploaded audio
         audio_bytes = await reference_audio.read()
-        audio_data, sample_rate = sf.read(io.BytesIO(audio_bytes))
+        audio_data, sample_rate = await asyncio.to_thread(sf.read, io.BytesIO(audio_bytes))
 
         logger.info(f"Creating voice clone '{name}' from {len(audio_bytes)} bytes")
 
@@ -274,15 +500,19 @@ async def clone_voice(
         logger.error(f"Voice cloning failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _is_japanese(text: str) -> bool:
+    """True if text contains hiragana, katakana or CJK ideographs"""
+    return _JA_RE.search(text) is not None
+
 def adjust_speed(audio: np.ndarray, speed: float) -> np.ndarray:
     """Adjust audio playback speed"""
     if speed == 1.0:
         return audio
 
-    # Simple resampling for speed adjustment
+    # Polyphase FIR resampling by the rational approximation of 1/speed
     from scipy import signal
-    target_length = int(len(audio) / speed)
-    return signal.resample(audio, target_length)
+    ratio = Fraction(1 / speed).limit_denominator(100)
+    return signal.resample_poly(audio, ratio.numerator, ratio.denominator, window=("kaiser", 5.0))
 
 if __name__ == "__main__":
     import uvicorn
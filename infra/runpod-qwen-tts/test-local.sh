@@ -68,6 +68,20 @@ else
     exit 1
 fi
 
+# Test 4: Streaming synthesis must carry PCM after the 44-byte WAV header
+echo "📝 Test 4: Streaming synthesis..."
+status=$(curl -s -o test_stream.wav -w "%{http_code}" -X POST "http://localhost:8000/synthesize/stream" \
+  -F "text=ストリーミングのテストです。" \
+  -F "language=ja" \
+  -F "speed=1.0")
+
+if [ "$status" = "200" ] && [ "$(wc -c < test_stream.wav)" -gt 44 ]; then
+    echo "✅ Streaming synthesis successful (test_stream.wav)"
+else
+    echo "❌ Streaming synthesis failed (HTTP $status, $(wc -c < test_stream.wav) bytes)"
+    exit 1
+fi
+
 echo ""
 echo "🎉 All tests passed!"
 echo ""
@@ -3,10 +3,17 @@ CosyVoice 2 TTS — RunPod Serverless Handler
 Supports: zero_shot, cross_lingual, instruct, sft modes
 """
 import runpod
+import asyncio
 import base64
 import io
 import os
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import httpx
+import soundfile as sf
 import torch
 import torchaudio
 
@@ -21,18 +28,77 @@ print(f"Loading CosyVoice2 from {MODEL_DIR}...")
 cosyvoice = CosyVoice2(MODEL_DIR, load_jit=False, load_trt=False)
 print(f"CosyVoice2 loaded. Sample rate: {cosyvoice.sample_rate}")
 
+# HQQ_BITS=4 or 8 quantizes the LLM front-end's linear layers with HQQ
+# (GPU only); 16 keeps them at full precision
+HQQ_BITS = int(os.environ.get("HQQ_BITS", "16"))
+HQQ_GROUP_SIZE = 64
+
+
+def quantize_llm(bits):
+    """Swap every nn.Linear in the LLM front-end for an HQQ-quantized copy.
+
+    The LLM decode is bound by weight reads, so 4/8-bit weights cut the
+    bytes moved per token. Flow matching and the vocoder stay untouched.
+    """
+    from hqq.core.quantize import BaseQuantizeConfig, HQQLinear
+
+    quant_config = BaseQuantizeConfig(nbits=bits, group_size=HQQ_GROUP_SIZE)
+    llm = cosyvoice.model.llm
+    targets = [
+        (name, module) for name, module in llm.named_modules()
+        if isinstance(module, torch.nn.Linear)
+    ]
+    for name, linear in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = llm.get_submodule(parent_name) if parent_name else llm
+        setattr(parent, child_name, HQQLinear(
+            linear,
+            quant_config=quant_config,
+            compute_dtype=linear.weight.dtype,
+            device="cuda",
+        ))
+    print(f"Quantized {len(targets)} LLM linear layers to {bits}-bit (HQQ)")
+
+
+if HQQ_BITS in (4, 8) and torch.cuda.is_available():
+    quantize_llm(HQQ_BITS)
+
 # Pre-load default speaker embeddings if available
 SPEAKERS_DIR = os.environ.get("SPEAKERS_DIR", "/data/speakers")
 
+# tmpfs keeps prompt WAVs in RAM; fall back to the default temp dir elsewhere
+PROMPT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+RESAMPLE_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Shared client so prompt URLs reuse HTTP/2 connections across requests
+_HTTPX = httpx.AsyncClient(
+    timeout=30, http2=True, limits=httpx.Limits(max_connections=32)
+)
+
+# Jobs in flight per worker: while one runs inference, the next can fetch
+# its prompt audio. Inference itself is serialized on one GPU thread.
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "2"))
+gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
 
-def load_audio_from_input(audio_data):
+@lru_cache(maxsize=16)
+def _get_resampler(sr):
+    """Resample(sr -> 16 kHz) on the model's device, built once per rate.
+
+    Building one designs the polyphase filter bank, so reuse it across
+    requests.
+    """
+    return torchaudio.transforms.Resample(sr, 16000).to(RESAMPLE_DEVICE)
+
+
+async def load_audio_from_input(audio_data):
     """Load audio from base64 string or URL."""
     if not audio_data:
         return None
 
     if audio_data.startswith("http://") or audio_data.startswith("https://"):
-        import requests
-        resp = requests.get(audio_data, timeout=30)
+        resp = await _HTTPX.get(audio_data)
         resp.raise_for_status()
         buf = io.BytesIO(resp.content)
     else:
@@ -40,15 +106,112 @@ def load_audio_from_input(audio_data):
         raw = base64.b64decode(audio_data)
         buf = io.BytesIO(raw)
 
+    return await asyncio.to_thread(_decode_prompt, buf)
+
+
+def _decode_prompt(buf):
+    """Decode prompt audio and resample it to 16 kHz."""
     waveform, sr = torchaudio.load(buf)
     # Resample to 16kHz if needed
     if sr != 16000:
-        resampler = torchaudio.transforms.Resample(sr, 16000)
-        waveform = resampler(waveform)
+        resampler = _get_resampler(sr)
+        waveform = resampler(waveform.to(RESAMPLE_DEVICE)).cpu()
     return waveform
 
 
-def handler(event):
+@contextmanager
+def prompt_wav_path(prompt_wav):
+    """Yield a per-request 16 kHz WAV path for APIs that only accept a path."""
+    with tempfile.NamedTemporaryFile(dir=PROMPT_DIR, suffix=".wav") as tmp:
+        torchaudio.save(tmp.name, prompt_wav, 16000)
+        yield tmp.name
+
+
+# libsndfile container and sample format per output format
+OUTPUT_FORMATS = {
+    "wav": ("WAV", "FLOAT", "audio/wav"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+}
+
+
+def _inference(text, mode, speaker_id, prompt_text, prompt_wav, instruct_text):
+    """Yield CosyVoice2 speech chunks ([1, n] tensors) for one request."""
+    if mode == "zero_shot":
+        # CosyVoice2 loads the prompt from a file path
+        with prompt_wav_path(prompt_wav) as tmp_path:
+            for r in cosyvoice.inference_zero_shot(
+                text, prompt_text, tmp_path, stream=False
+            ):
+                yield r["tts_speech"]
+    elif mode == "cross_lingual":
+        with prompt_wav_path(prompt_wav) as tmp_path:
+            for r in cosyvoice.inference_cross_lingual(
+                text, tmp_path, stream=False
+            ):
+                yield r["tts_speech"]
+    elif mode == "instruct":
+        with prompt_wav_path(prompt_wav) as tmp_path:
+            for r in cosyvoice.inference_instruct2(
+                text, instruct_text, tmp_path, stream=False
+            ):
+                yield r["tts_speech"]
+    else:
+        # SFT mode — use built-in speaker
+        spk = speaker_id or cosyvoice.list_available_spks()[0]
+        for r in cosyvoice.inference_sft(text, spk, stream=False):
+            yield r["tts_speech"]
+
+
+def _apply_tempo(chunks, speed):
+    """Time-stretch each chunk with sox tempo (pitch preserved)."""
+    effects = [["tempo", str(speed)]]
+    for chunk in chunks:
+        stretched, _ = torchaudio.sox_effects.apply_effects_tensor(
+            chunk.cpu(), cosyvoice.sample_rate, effects
+        )
+        yield stretched
+
+
+def synthesize(text, mode, speaker_id, prompt_text, prompt_wav, instruct_text,
+               speed, output_format):
+    """Run CosyVoice2 inference for one request and encode the result."""
+    chunks = _inference(
+        text, mode, speaker_id, prompt_text, prompt_wav, instruct_text
+    )
+
+    # Apply speed adjustment if needed. Chunks are whole sentences, so
+    # tempo is applied per chunk as it arrives.
+    if speed != 1.0 and speed > 0:
+        chunks = _apply_tempo(chunks, speed)
+
+    # Encode each chunk as it arrives instead of concatenating the clip first
+    if output_format != "mp3":
+        output_format = "wav"
+    container, subtype, content_type = OUTPUT_FORMATS[output_format]
+    buffer = io.BytesIO()
+    num_samples = 0
+    with sf.SoundFile(buffer, mode="w", samplerate=cosyvoice.sample_rate,
+                      channels=1, format=container, subtype=subtype) as f:
+        for chunk in chunks:
+            f.write(chunk.squeeze(0).cpu().numpy())
+            num_samples += chunk.shape[1]
+
+    if not num_samples:
+        return {"error": "No audio generated"}
+
+    with buffer.getbuffer() as view:
+        audio_b64 = base64.b64encode(view).decode("ascii")
+
+    return {
+        "audio_base64": audio_b64,
+        "sample_rate": cosyvoice.sample_rate,
+        "format": output_format,
+        "content_type": content_type,
+        "duration_ms": int(num_samples / cosyvoice.sample_rate * 1000),
+    }
+
+
+async def handler(event):
     """Main handler for RunPod serverless."""
     input_data = event.get("input", {})
 
@@ -63,76 +226,21 @@ def handler(event):
 
     if not text:
         return {"error": "text is required"}
+    if mode in ("zero_shot", "cross_lingual") and not prompt_audio:
+        return {"error": f"prompt_audio is required for {mode} mode"}
+    if mode == "instruct" and (not prompt_audio or not instruct_text):
+        return {"error": "prompt_audio and instruct_text required for instruct mode"}
 
     try:
-        # Run inference based on mode
-        if mode == "zero_shot":
-            if not prompt_audio:
-                return {"error": "prompt_audio is required for zero_shot mode"}
-            prompt_wav = load_audio_from_input(prompt_audio)
-            # Save to temp file (CosyVoice expects file path)
-            tmp_path = "/tmp/prompt.wav"
-            torchaudio.save(tmp_path, prompt_wav, 16000)
-            results = list(cosyvoice.inference_zero_shot(
-                text, prompt_text, tmp_path, stream=False
-            ))
-        elif mode == "cross_lingual":
-            if not prompt_audio:
-                return {"error": "prompt_audio is required for cross_lingual mode"}
-            prompt_wav = load_audio_from_input(prompt_audio)
-            tmp_path = "/tmp/prompt.wav"
-            torchaudio.save(tmp_path, prompt_wav, 16000)
-            results = list(cosyvoice.inference_cross_lingual(
-                text, tmp_path, stream=False
-            ))
-        elif mode == "instruct":
-            if not prompt_audio or not instruct_text:
-                return {"error": "prompt_audio and instruct_text required for instruct mode"}
-            prompt_wav = load_audio_from_input(prompt_audio)
-            tmp_path = "/tmp/prompt.wav"
-            torchaudio.save(tmp_path, prompt_wav, 16000)
-            results = list(cosyvoice.inference_instruct2(
-                text, instruct_text, tmp_path, stream=False
-            ))
-        else:
-            # SFT mode — use built-in speaker
-            spk = speaker_id or cosyvoice.list_available_spks()[0]
-            results = list(cosyvoice.inference_sft(
-                text, spk, stream=False
-            ))
-
-        if not results:
-            return {"error": "No audio generated"}
-
-        # Combine audio chunks
-        audio_chunks = [r["tts_speech"] for r in results]
-        combined = torch.cat(audio_chunks, dim=1)
-
-        # Apply speed adjustment if needed
-        if speed != 1.0 and speed > 0:
-            effects = [["tempo", str(speed)]]
-            combined, _ = torchaudio.sox_effects.apply_effects_tensor(
-                combined, cosyvoice.sample_rate, effects
-            )
-
-        # Encode to output format
-        buffer = io.BytesIO()
-        if output_format == "mp3":
-            torchaudio.save(buffer, combined, cosyvoice.sample_rate, format="mp3")
-            content_type = "audio/mpeg"
-        else:
-            torchaudio.save(buffer, combined, cosyvoice.sample_rate, format="wav")
-            content_type = "audio/wav"
-
-        audio_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-        return {
-            "audio_base64": audio_b64,
-            "sample_rate": cosyvoice.sample_rate,
-            "format": output_format,
-            "content_type": content_type,
-            "duration_ms": int(combined.shape[1] / cosyvoice.sample_rate * 1000),
-        }
+        prompt_wav = None
+        if mode in ("zero_shot", "cross_lingual", "instruct"):
+            prompt_wav = await load_audio_from_input(prompt_audio)
+
+        # Off the event loop so the next job's fetch overlaps this inference
+        return await asyncio.get_running_loop().run_in_executor(
+            gpu_executor, synthesize, text, mode, speaker_id, prompt_text,
+            prompt_wav, instruct_text, speed, output_format,
+        )
 
     except Exception as e:
         return {"error": str(e)}
@@ -151,4 +259,5 @@ def info_handler(event):
 
 runpod.serverless.start({
     "handler": handler,
+    "concurrency_modifier": lambda current: MAX_CONCURRENCY,
 })
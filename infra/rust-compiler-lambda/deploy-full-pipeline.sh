@@ -6,6 +6,8 @@ set -e
 
 REGION="ap-northeast-1"
 FUNCTION_NAME="rust-full-pipeline"
+# デプロイZIPの一時置き場（任意）。未設定ならZIPを直接渡す
+SCRATCH_BUCKET="${SCRATCH_BUCKET:-}"
 
 echo "🚀 デプロイ: GitHub → 編集 → コンパイル → デプロイ Pipeline"
 echo "=========================================================="
@@ -15,7 +17,7 @@ cat > Dockerfile.pipeline << 'DOCKERFILE'
 FROM public.ecr.aws/lambda/python:3.12
 
 # 必要なツールをインストール
-RUN yum install -y git gcc zip && \
+RUN yum install -y git gcc && \
     curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- -y --default-toolchain stable && \
     . $HOME/.cargo/env && \
     rustup target add aarch64-unknown-linux-musl && \
@@ -92,7 +94,10 @@ TRUST
       "lambda:GetFunction",
       "iam:GetRole",
       "iam:CreateRole",
-      "iam:AttachRolePolicy"
+      "iam:AttachRolePolicy",
+      "s3:PutObject",
+      "s3:GetObject",
+      "s3:DeleteObject"
     ],
     "Resource": "*"
   }]
@@ -113,6 +118,13 @@ if aws lambda get-function --function-name $FUNCTION_NAME --region $REGION 2>/de
         --function-name $FUNCTION_NAME \
         --image-uri $ECR_URI:latest \
         --region $REGION
+    if [ -n "$SCRATCH_BUCKET" ]; then
+        aws lambda wait function-updated --function-name $FUNCTION_NAME --region $REGION
+        aws lambda update-function-configuration \
+            --function-name $FUNCTION_NAME \
+            --environment "Variables={SCRATCH_BUCKET=$SCRATCH_BUCKET}" \
+            --region $REGION
+    fi
 else
     aws lambda create-function \
         --function-name $FUNCTION_NAME \
@@ -121,6 +133,7 @@ else
         --role $ROLE_ARN \
         --timeout 900 \
         --memory-size 3008 \
+        --environment "Variables={SCRATCH_BUCKET=$SCRATCH_BUCKET}" \
         --region $REGION
 fi
 
@@ -9,12 +9,80 @@ import json
 import os
 import subprocess
 import tempfile
+import tomllib
+import uuid
 import boto3
+from botocore.config import Config
 import shutil
+import zipfile
 from pathlib import Path
 
-lambda_client = boto3.client('lambda')
-iam_client = boto3.client('iam')
+# ウォームコンテナ間で接続を使い回す
+boto_config = Config(tcp_keepalive=True, retries={'max_attempts': 3, 'mode': 'standard'})
+lambda_client = boto3.client('lambda', config=boto_config)
+iam_client = boto3.client('iam', config=boto_config)
+s3_client = boto3.client('s3', config=boto_config)
+
+# デプロイZIPの一時置き場。設定時はS3経由で渡す（ZipFile直渡しの50MB制限も回避）
+SCRATCH_BUCKET = os.environ.get('SCRATCH_BUCKET')
+
+ROLE_NAME = 'lambda-rust-execution-role'
+
+# /tmpはウォームコンテナ間で残るので、crateインデックスとソースを使い回す
+CARGO_ENV = {
+    **os.environ,
+    'CARGO_HOME': '/tmp/cargo',
+    'CARGO_NET_GIT_FETCH_WITH_CLI': 'true',
+}
+
+# 解決済みのロールARN（ウォームコンテナではIAMを呼ばない）
+_role_arn = None
+
+def read_project_name(cargo_toml):
+    """Cargo.tomlの[package].nameを返す（見つからなければNone）"""
+    with open(cargo_toml, 'rb') as f:
+        manifest = tomllib.load(f)
+    name = manifest.get('package', {}).get('name')
+    if name:
+        return name
+
+    # [package]が無い場合は従来の行スキャンにフォールバック
+    with open(cargo_toml) as f:
+        for line in f:
+            if line.startswith('name = '):
+                return line.split('"')[1]
+    return None
+
+def resolve_role_arn():
+    """実行ロールのARNを返す（無ければ作成する）"""
+    try:
+        role = iam_client.get_role(RoleName=ROLE_NAME)
+        return role['Role']['Arn']
+    except:
+        # ロールを作成
+        trust_policy = {
+            "Version": "2012-10-17",
+            "Statement": [{
+                "Effect": "Allow",
+                "Principal": {"Service": "lambda.amazonaws.com"},
+                "Action": "sts:AssumeRole"
+            }]
+        }
+
+        role = iam_client.create_role(
+            RoleName=ROLE_NAME,
+            AssumeRolePolicyDocument=json.dumps(trust_policy)
+        )
+
+        iam_client.attach_role_policy(
+            RoleName=ROLE_NAME,
+            PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
+        )
+
+        # ロールの伝播待ち
+        import time
+        time.sleep(10)
+        return role['Role']['Arn']
 
 def lambda_handler(event, context):
     """
@@ -26,6 +94,7 @@ def lambda_handler(event, context):
         "use_ai_edit": true
     }
     """
+    global _role_arn
 
     github_url = event.get('github_url')
     edit_instruction = event.get('edit_instruction', '')
@@ -45,7 +114,7 @@ def lambda_handler(event, context):
         print(f"Cloning {github_url}...")
         repo_dir = os.path.join(work_dir, 'repo')
         subprocess.run(
-            ['git', 'clone', '--depth', '1', github_url, repo_dir],
+            ['git', 'clone', '--filter=blob:none', '--depth', '1', github_url, repo_dir],
             check=True,
             capture_output=True
         )
@@ -69,13 +138,27 @@ def lambda_handler(event, context):
         print("Compiling Rust project...")
         os.chdir(repo_dir)
 
-        # ARM64用にクロスコンパイル
+        # 依存crateを先に取得（Cargo.lockがあればその通りに）
+        fetch_cmd = ['cargo', 'fetch', '--target', 'aarch64-unknown-linux-musl']
+        if os.path.exists(os.path.join(repo_dir, 'Cargo.lock')):
+            fetch_cmd.append('--locked')
         compile_result = subprocess.run(
-            ['cargo', 'build', '--release', '--target', 'aarch64-unknown-linux-musl'],
+            fetch_cmd,
             capture_output=True,
-            text=True
+            text=True,
+            env=CARGO_ENV
         )
 
+        # ARM64用にクロスコンパイル
+        if compile_result.returncode == 0:
+            compile_result = subprocess.run(
+                ['cargo', 'build', '--release', '--target', 'aarch64-unknown-linux-musl',
+                 '-j', str(os.cpu_count() or 1)],
+                capture_output=True,
+                text=True,
+                env=CARGO_ENV
+            )
+
         if compile_result.returncode != 0:
             return {
                 'statusCode': 500,
@@ -86,12 +169,7 @@ def lambda_handler(event, context):
             }
 
         # プロジェクト名を取得
-        project_name = None
-        with open(cargo_toml) as f:
-            for line in f:
-                if line.startswith('name = '):
-                    project_name = line.split('"')[1]
-                    break
+        project_name = read_project_name(cargo_toml)
 
         if not project_name:
             return {
@@ -112,78 +190,60 @@ def lambda_handler(event, context):
             }
 
         # Step 4: Lambda用にパッケージング
+        # バイナリをbootstrapとして無圧縮(ZIP_STORED)でZIPに格納
         print("Packaging for Lambda...")
-        package_dir = os.path.join(work_dir, 'package')
-        os.makedirs(package_dir)
-
-        bootstrap_path = os.path.join(package_dir, 'bootstrap')
-        shutil.copy2(binary_path, bootstrap_path)
-        os.chmod(bootstrap_path, 0o755)
-
-        # ZIP作成
+        bootstrap_info = zipfile.ZipInfo.from_file(binary_path, arcname='bootstrap')
+        bootstrap_info.external_attr = 0o100755 << 16  # 実行権限付きの通常ファイル
         zip_path = os.path.join(work_dir, 'deployment.zip')
-        subprocess.run(
-            ['zip', '-j', zip_path, bootstrap_path],
-            check=True,
-            capture_output=True
-        )
+        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as z:
+            with open(binary_path, 'rb') as src, z.open(bootstrap_info, 'w') as dst:
+                shutil.copyfileobj(src, dst)
 
         # Step 5: Lambdaにデプロイ
         print(f"Deploying to Lambda function: {function_name}")
 
-        with open(zip_path, 'rb') as f:
-            zip_content = f.read()
+        # IAMロールの取得/作成（コンテナ内で一度だけ）
+        if _role_arn is None:
+            _role_arn = resolve_role_arn()
+        role_arn = _role_arn
 
-        # IAMロールの取得/作成
-        role_name = 'lambda-rust-execution-role'
-        try:
-            role = iam_client.get_role(RoleName=role_name)
-            role_arn = role['Role']['Arn']
-        except:
-            # ロールを作成
-            trust_policy = {
-                "Version": "2012-10-17",
-                "Statement": [{
-                    "Effect": "Allow",
-                    "Principal": {"Service": "lambda.amazonaws.com"},
-                    "Action": "sts:AssumeRole"
-                }]
-            }
-
-            role = iam_client.create_role(
-                RoleName=role_name,
-                AssumeRolePolicyDocument=json.dumps(trust_policy)
-            )
-            role_arn = role['Role']['Arn']
-
-            iam_client.attach_role_policy(
-                RoleName=role_name,
-                PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
+        if SCRATCH_BUCKET:
+            # チャンク単位でS3にストリーミングし、ZIP全体をメモリに載せない
+            zip_key = f"rust-pipeline/{function_name}/{uuid.uuid4().hex}.zip"
+            s3_client.upload_file(
+                zip_path, SCRATCH_BUCKET, zip_key,
+                ExtraArgs={'ContentType': 'application/zip'}
             )
-
-            # ロールの伝播待ち
-            import time
-            time.sleep(10)
+            code = {'S3Bucket': SCRATCH_BUCKET, 'S3Key': zip_key}
+        else:
+            with open(zip_path, 'rb') as f:
+                code = {'ZipFile': f.read()}
 
         # Lambda関数の作成/更新
         try:
-            lambda_client.update_function_code(
-                FunctionName=function_name,
-                ZipFile=zip_content
-            )
-            action = 'updated'
-        except lambda_client.exceptions.ResourceNotFoundException:
-            lambda_client.create_function(
-                FunctionName=function_name,
-                Runtime='provided.al2023',
-                Role=role_arn,
-                Handler='bootstrap',
-                Code={'ZipFile': zip_content},
-                Architectures=['arm64'],
-                Timeout=30,
-                MemorySize=512
-            )
-            action = 'created'
+            try:
+                lambda_client.update_function_code(
+                    FunctionName=function_name,
+                    Publish=False,
+                    **code
+                )
+                action = 'updated'
+            except lambda_client.exceptions.ResourceNotFoundException:
+                lambda_client.create_function(
+                    FunctionName=function_name,
+                    Runtime='provided.al2023',
+                    Role=role_arn,
+                    Handler='bootstrap',
+                    Code=code,
+                    Architectures=['arm64'],
+                    Timeout=30,
+                    MemorySize=512
+                )
+                action = 'created'
+        finally:
+            # Lambdaは呼び出しが返る時点でコードをコピー済みなので一時ZIPは不要
+            if 'S3Key' in code:
+                s3_client.delete_object(Bucket=SCRATCH_BUCKET, Key=code['S3Key'])
 
         return {
             'statusCode': 200,